@@ -7,7 +7,9 @@ import argparse
 from models.chess_net import ChessNet
 from memory.replay_buffer import ReplayBuffer
 from mcts.mcts import mcts_search
+from mcts.eval_cache import EvaluationCache
 from training.self_play import self_play
+from training.parallel_self_play import SelfPlayPool
 from training.trainer import train_network
 from evaluation.evaluator import evaluate_model
 
@@ -21,16 +23,28 @@ def main(args):
     print(f"使用设备: {device}")
     
     # 初始化模型
-    model = ChessNet(args.input_channels)
+    model = ChessNet(args.input_channels, canonical=args.canonical)
     model.to(device)
     optimizer = optim.Adam(model.parameters(), lr=args.learning_rate)
     replay_buffer = ReplayBuffer(capacity=args.buffer_capacity)
+    # 神经网络评估缓存，在所有对弈和评估之间共享，模型权重更新后旧的缓存项自动失效
+    eval_cache = EvaluationCache(capacity=args.eval_cache_size, symmetric=args.symmetric_cache)
     
     # 加载已有模型（如果存在）
     if args.load_model and os.path.exists(args.load_model):
         model.load_state_dict(torch.load(args.load_model, map_location=device))
         print(f"已加载模型: {args.load_model}")
     
+    # 多进程自我对弈: 推理进程热加载训练后的权重
+    pool = None
+    if args.self_play_workers > 0:
+        pool = SelfPlayPool(model, os.path.join(args.save_dir, "self_play_latest.pth"),
+                            num_workers=args.self_play_workers, device=device,
+                            mcts_simulations=args.mcts_simulations, mcts_batch_size=args.mcts_batch_size,
+                            mcts_threads=args.mcts_threads, root_policy=args.root_policy,
+                            cache_size=args.eval_cache_size, inference=args.inference,
+                            symmetric_cache=args.symmetric_cache, mirror_augment=args.mirror_augment)
+    
     best_win_rate = 0.0
     current_opponent = None  # 初始对手为随机
     
@@ -41,13 +55,19 @@ def main(args):
             print(f"随机对弈迭代 {iteration+1}/{args.random_iterations}")
             
             # 对抗随机收集数据
-            training_data = self_play(model, device, num_games=args.games_per_iteration, 
-                                     mcts_simulations=args.mcts_simulations, 
-                                     opponent='random')
+            if pool is not None:
+                pool.update(model)
+                training_data = pool.play(args.games_per_iteration, opponent='random')
+            else:
+                training_data = self_play(model, device, num_games=args.games_per_iteration, 
+                                         mcts_simulations=args.mcts_simulations, 
+                                         opponent='random', mcts_batch_size=args.mcts_batch_size,
+                                         cache=eval_cache, mcts_threads=args.mcts_threads,
+                                         root_policy=args.root_policy, inference=args.inference,
+                                         mirror_augment=args.mirror_augment)
             
             # 存入回放缓冲区
-            for data in training_data:
-                replay_buffer.add(*data)
+            replay_buffer.add_game(training_data)
             
             # 训练网络
             if len(replay_buffer) >= args.batch_size:
@@ -55,7 +75,8 @@ def main(args):
                 train_network(model, optimizer, batch, device, epochs=args.epochs, batch_size=args.batch_size)
             
             # 评估并保存模型
-            win_rate = evaluate_model(model, device, num_games=args.eval_games, opponent='random')
+            win_rate = evaluate_model(model, device, num_games=args.eval_games, opponent='random', cache=eval_cache,
+                                      time_limit=args.eval_time_limit, inference=args.inference)
             if win_rate > best_win_rate:
                 best_win_rate = win_rate
                 torch.save(model.state_dict(), os.path.join(args.save_dir, "model_vs_random_best.pth"))
@@ -78,13 +99,19 @@ def main(args):
         print(f"自我博弈迭代 {iteration+1}/{args.self_play_iterations}")
         
         # 自我对弈收集数据
-        training_data = self_play(model, device, num_games=args.games_per_iteration, 
-                                 mcts_simulations=args.mcts_simulations, 
-                                 opponent='self')
+        if pool is not None:
+            pool.update(model)
+            training_data = pool.play(args.games_per_iteration, opponent='self')
+        else:
+            training_data = self_play(model, device, num_games=args.games_per_iteration, 
+                                     mcts_simulations=args.mcts_simulations, 
+                                     opponent='self', mcts_batch_size=args.mcts_batch_size,
+                                     cache=eval_cache, mcts_threads=args.mcts_threads,
+                                     root_policy=args.root_policy, inference=args.inference,
+                                     mirror_augment=args.mirror_augment)
         
         # 存入回放缓冲区
-        for data in training_data:
-            replay_buffer.add(*data)
+        replay_buffer.add_game(training_data)
         
         # 从缓冲区采样训练
         if len(replay_buffer) >= args.batch_size:
@@ -97,10 +124,13 @@ def main(args):
             if iteration >= args.eval_against_past and os.path.exists(os.path.join(args.save_dir, f"model_iter_{iteration-args.eval_against_past}.pth")):
                 win_rate = evaluate_model(model, device, num_games=args.eval_games, 
                                          opponent='past', 
-                                         opponent_path=os.path.join(args.save_dir, f"model_iter_{iteration-args.eval_against_past}.pth"))
+                                         opponent_path=os.path.join(args.save_dir, f"model_iter_{iteration-args.eval_against_past}.pth"),
+                                         cache=eval_cache, time_limit=args.eval_time_limit,
+                                         inference=args.inference)
                 print(f"对抗历史模型评估: 胜率={win_rate:.2f}")
             else:
-                win_rate = evaluate_model(model, device, num_games=args.eval_games, opponent='random')
+                win_rate = evaluate_model(model, device, num_games=args.eval_games, opponent='random', cache=eval_cache,
+                                          time_limit=args.eval_time_limit, inference=args.inference)
                 print(f"对抗随机模型评估: 胜率={win_rate:.2f}")
             
             if win_rate > best_win_rate:
@@ -112,6 +142,9 @@ def main(args):
         torch.save(model.state_dict(), os.path.join(args.save_dir, f"model_iter_{iteration}.pth"))
         print(f"完成自我博弈迭代 {iteration+1}/{args.self_play_iterations}")
     
+    if pool is not None:
+        pool.close()
+    
     # 保存最终模型
     torch.save(model.state_dict(), os.path.join(args.save_dir, "model_final.pth"))
     print("训练完成！")
@@ -121,6 +154,7 @@ if __name__ == "__main__":
     
     # 模型参数
     parser.add_argument("--input_channels", type=int, default=15, help="输入通道数")
+    parser.add_argument("--canonical", action="store_true", help="网络统一从走棋方的视角计算(黑方走棋时红黑互换)")
     
     # 训练参数
     parser.add_argument("--learning_rate", type=float, default=0.001, help="学习率")
@@ -128,6 +162,17 @@ if __name__ == "__main__":
     parser.add_argument("--batch_size", type=int, default=128, help="批次大小")
     parser.add_argument("--epochs", type=int, default=10, help="每次迭代的训练轮数")
     parser.add_argument("--mcts_simulations", type=int, default=50, help="MCTS模拟次数")
+    parser.add_argument("--mcts_threads", type=int, default=1, help="MCTS树并行搜索的线程数")
+    parser.add_argument("--self_play_workers", type=int, default=0,
+                        help="自我对弈进程数，大于0时多进程对弈并由一个推理进程批量计算网络")
+    parser.add_argument("--root_policy", type=str, default="puct", choices=["puct", "gumbel"],
+                        help="自我对弈时MCTS根节点的选择方式(gumbel适合较少的模拟次数)")
+    parser.add_argument("--inference", type=str, default=None, choices=["fp32", "int8"],
+                        help="自我对弈和评估时使用导出的CPU推理模型(折叠BN + TorchScript，int8另外量化全连接层)")
+    parser.add_argument("--symmetric_cache", action="store_true", help="评估缓存中左右镜像、红黑互换的局面共用缓存项")
+    parser.add_argument("--mirror_augment", action="store_true", help="自我对弈样本加入左右镜像的副本")
+    parser.add_argument("--eval_cache_size", type=int, default=200000, help="神经网络评估缓存的最大局面数")
+    parser.add_argument("--mcts_batch_size", type=int, default=1, help="MCTS每轮批量评估的叶节点数(使用虚拟损失)")
     parser.add_argument("--save_dir", type=str, default="models/saved", help="模型保存目录")
     parser.add_argument("--use_cuda", action="store_true", help="是否使用CUDA")
     parser.add_argument("--load_model", type=str, default=None, help="加载预训练模型路径")
@@ -142,6 +187,7 @@ if __name__ == "__main__":
     
     # 评估参数
     parser.add_argument("--eval_games", type=int, default=10, help="评估时的对弈局数")
+    parser.add_argument("--eval_time_limit", type=float, default=None, help="评估时每步的搜索时间上限(秒)")
     parser.add_argument("--eval_frequency", type=int, default=5, help="评估频率（迭代次数）")
     parser.add_argument("--eval_against_past", type=int, default=10, help="对抗多少迭代之前的模型")
     
@@ -1,5 +1,346 @@
 import numpy as np
-import copy
+
+# 棋盘大小: 10行 9列
+BOARD_ROWS = 10
+BOARD_COLS = 9
+
+# 一维填充棋盘(mailbox): 上下各填充2行、左右各填充1列哨兵格，
+# 这样马、象、车等越界的走法都会落在哨兵格上，不需要额外的边界判断
+PADDED_ROWS = BOARD_ROWS + 4
+PADDED_COLS = BOARD_COLS + 2
+PADDED_SIZE = PADDED_ROWS * PADDED_COLS
+OFFBOARD = 8  # 哨兵格的值，绝对值大于所有棋子ID
+
+
+def square_of(pos):
+    """将(row, col)坐标转换为填充棋盘上的格子编号"""
+    row, col = pos
+    return (row + 2) * PADDED_COLS + col + 1
+
+
+# 填充棋盘格子编号 <-> (row, col) 坐标
+SQUARE_TO_POS = [None] * PADDED_SIZE
+POS_TO_SQUARE = {}
+for _row in range(BOARD_ROWS):
+    for _col in range(BOARD_COLS):
+        SQUARE_TO_POS[square_of((_row, _col))] = (_row, _col)
+        POS_TO_SQUARE[(_row, _col)] = square_of((_row, _col))
+
+# 按行优先顺序排列的90个棋盘格子，用于转换回10x9数组
+BOARD_SQUARES = np.array([POS_TO_SQUARE[(r, c)] for r in range(BOARD_ROWS) for c in range(BOARD_COLS)])
+
+# 填充棋盘格子编号 -> 行优先的0-89下标，哨兵格为-1
+SQUARE_TO_INDEX = [-1] * PADDED_SIZE
+for _index, _sq in enumerate(BOARD_SQUARES.tolist()):
+    SQUARE_TO_INDEX[_sq] = _index
+
+# 神经网络输入: 14个棋子平面(棋子ID依次为-7..-1, 1..7)，加1个当前玩家平面
+STATE_PLANES = 15
+PLANE_PIECE_IDS = np.array([piece_id for piece_id in range(-7, 8) if piece_id != 0], dtype=np.int8)
+# PIECE_PLANE[piece_id + 7] 为该棋子所在的平面
+PIECE_PLANE = [-1] * 15
+for _plane, _piece_id in enumerate(PLANE_PIECE_IDS.tolist()):
+    PIECE_PLANE[_piece_id + 7] = _plane
+
+# 走子方向(填充棋盘上的偏移量)
+UP, DOWN, LEFT, RIGHT = -PADDED_COLS, PADDED_COLS, -1, 1
+ORTHOGONAL_STEPS = (UP, RIGHT, DOWN, LEFT)
+DIAGONAL_STEPS = (UP + LEFT, UP + RIGHT, DOWN + LEFT, DOWN + RIGHT)
+# 马走"日"，(目标偏移, 马脚偏移)
+KNIGHT_STEPS = (
+    (2 * UP + LEFT, UP), (2 * UP + RIGHT, UP),
+    (2 * LEFT + UP, LEFT), (2 * LEFT + DOWN, LEFT),
+    (2 * RIGHT + UP, RIGHT), (2 * RIGHT + DOWN, RIGHT),
+    (2 * DOWN + LEFT, DOWN), (2 * DOWN + RIGHT, DOWN),
+)
+# 相/象走"田"，(目标偏移, 象眼偏移)
+BISHOP_STEPS = tuple((2 * step, step) for step in DIAGONAL_STEPS)
+
+# 九宫格和本方半场(相/象不能过河)
+PALACE = {
+    1: frozenset(POS_TO_SQUARE[(r, c)] for r in range(7, 10) for c in range(3, 6)),
+    -1: frozenset(POS_TO_SQUARE[(r, c)] for r in range(0, 3) for c in range(3, 6)),
+}
+HOME_HALF = {
+    1: frozenset(POS_TO_SQUARE[(r, c)] for r in range(5, 10) for c in range(BOARD_COLS)),
+    -1: frozenset(POS_TO_SQUARE[(r, c)] for r in range(0, 5) for c in range(BOARD_COLS)),
+}
+
+# 初始局面，按行优先给出每个格子的棋子ID
+INITIAL_BOARD = (
+    (-1, -2, -3, -4, -5, -4, -3, -2, -1),
+    (0, 0, 0, 0, 0, 0, 0, 0, 0),
+    (0, -6, 0, 0, 0, 0, 0, -6, 0),
+    (-7, 0, -7, 0, -7, 0, -7, 0, -7),
+    (0, 0, 0, 0, 0, 0, 0, 0, 0),
+    (0, 0, 0, 0, 0, 0, 0, 0, 0),
+    (7, 0, 7, 0, 7, 0, 7, 0, 7),
+    (0, 6, 0, 0, 0, 0, 0, 6, 0),
+    (0, 0, 0, 0, 0, 0, 0, 0, 0),
+    (1, 2, 3, 4, 5, 4, 3, 2, 1),
+)
+
+# Zobrist哈希随机数，ZOBRIST_PIECE_KEYS[piece_id + 7][square]，空位(piece_id=0)一行全为0
+_zobrist_rng = np.random.default_rng(0x5A0B)
+ZOBRIST_PIECE_KEYS = [
+    [0] * PADDED_SIZE if piece_id == 0 else
+    [int(key) for key in _zobrist_rng.integers(0, 2 ** 64, size=PADDED_SIZE, dtype=np.uint64)]
+    for piece_id in range(-7, 8)
+]
+ZOBRIST_BLACK_TO_MOVE = int(_zobrist_rng.integers(0, 2 ** 64, dtype=np.uint64))
+
+# 同一局面(同一方走棋)出现的次数达到该值时按重复局面判定结果
+REPETITION_LIMIT = 3
+# 重复局面计数: 每隔这么多个可逆走法把局面出现次数合并成一个新的计数表，push()时最多回溯这么多步
+WINDOW_SNAPSHOT_INTERVAL = 16
+
+# FEN中的棋子字母，大写为红方，小写为黑方(读取时也接受马H、相E的写法)
+FEN_PIECES = {1: 'R', 2: 'N', 3: 'B', 4: 'A', 5: 'K', 6: 'C', 7: 'P'}
+FEN_PIECE_IDS = {letter: piece_type for piece_type, letter in FEN_PIECES.items()}
+FEN_PIECE_IDS.update({'H': 2, 'E': 3})
+INITIAL_FEN = 'rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1'
+
+# 二进制局面格式: 45字节棋盘(每格4位，按行优先两格一字节) + 1字节走棋方(0红1黑) + 2字节回合数(小端)
+PACKED_POSITION_SIZE = 48
+
+
+def _geometric_moves():
+    """枚举所有在几何上可能出现的走法(不考虑棋子阻挡和将帅安全)，返回按起点、终点下标排序的(起点格, 终点格)列表
+    
+    车、炮、将/帅、兵/卒的走法都包含在同行同列的直线走法中，另外加上马的"日"字走法、
+    士在九宫内的斜线走法和相/象在本方半场象位之间的"田"字走法
+    """
+    def on_board(sq):
+        return 0 <= sq < PADDED_SIZE and SQUARE_TO_POS[sq] is not None
+    
+    moves = set()
+    for from_sq in BOARD_SQUARES.tolist():
+        for step in ORTHOGONAL_STEPS:
+            to_sq = from_sq + step
+            while on_board(to_sq):
+                moves.add((from_sq, to_sq))
+                to_sq += step
+        for step, _ in KNIGHT_STEPS:
+            if on_board(from_sq + step):
+                moves.add((from_sq, from_sq + step))
+    
+    # 士和相/象只能到达从初始位置出发可达的格子
+    for piece_type, steps, region in ((4, DIAGONAL_STEPS, PALACE), (3, [step for step, _ in BISHOP_STEPS], HOME_HALF)):
+        for player in (1, -1):
+            frontier = [POS_TO_SQUARE[(row, col)] for row in range(BOARD_ROWS) for col in range(BOARD_COLS)
+                        if INITIAL_BOARD[row][col] == piece_type * player]
+            reached = set(frontier)
+            while frontier:
+                from_sq = frontier.pop()
+                for step in steps:
+                    to_sq = from_sq + step
+                    if to_sq in region[player]:
+                        moves.add((from_sq, to_sq))
+                        if to_sq not in reached:
+                            reached.add(to_sq)
+                            frontier.append(to_sq)
+    
+    return sorted(moves, key=lambda move: (SQUARE_TO_INDEX[move[0]], SQUARE_TO_INDEX[move[1]]))
+
+
+# 策略向量的走法编号: 所有几何上可能的走法按起点、终点的行优先下标排序后依次编号，与ChessNet策略头的输出一一对应
+POLICY_MOVES = _geometric_moves()
+POLICY_SIZE = len(POLICY_MOVES)  # 2086
+# 走法编号 -> 起点格/终点格
+POLICY_FROM_SQUARE = np.array([from_sq for from_sq, _ in POLICY_MOVES], dtype=np.int64)
+POLICY_TO_SQUARE = np.array([to_sq for _, to_sq in POLICY_MOVES], dtype=np.int64)
+# POLICY_INDEX_TABLE[起点格, 终点格] -> 走法编号，不可能的走法为-1，可以用格子编号数组批量查表
+POLICY_INDEX_TABLE = np.full((PADDED_SIZE, PADDED_SIZE), -1, dtype=np.int64)
+POLICY_INDEX_TABLE[POLICY_FROM_SQUARE, POLICY_TO_SQUARE] = np.arange(POLICY_SIZE)
+# ((起点行, 起点列), (终点行, 终点列)) <-> 走法编号，与get_legal_actions()的动作格式相同
+INDEX_TO_MOVE = [(SQUARE_TO_POS[from_sq], SQUARE_TO_POS[to_sq]) for from_sq, to_sq in POLICY_MOVES]
+MOVE_TO_INDEX = {move: index for index, move in enumerate(INDEX_TO_MOVE)}
+
+# 棋盘的对称变换: 左右镜像(列c -> 8-c)，红黑互换(棋盘旋转180度并交换双方棋子，走棋方也交换)。
+# 象棋规则在两种变换下都不变，镜像或互换后的局面与原局面等价
+MIRROR_SQUARE = list(range(PADDED_SIZE))
+FLIP_SQUARE = list(range(PADDED_SIZE))
+for (_row, _col), _sq in POS_TO_SQUARE.items():
+    MIRROR_SQUARE[_sq] = POS_TO_SQUARE[(_row, BOARD_COLS - 1 - _col)]
+    FLIP_SQUARE[_sq] = POS_TO_SQUARE[(BOARD_ROWS - 1 - _row, BOARD_COLS - 1 - _col)]
+# 变换后的走法编号: MIRROR_POLICY[i]为走法i镜像后的编号。两者都是对合置换，policy[..., MIRROR_POLICY]即为镜像局面的策略
+MIRROR_POLICY = POLICY_INDEX_TABLE[np.take(MIRROR_SQUARE, POLICY_FROM_SQUARE), np.take(MIRROR_SQUARE, POLICY_TO_SQUARE)]
+FLIP_POLICY = POLICY_INDEX_TABLE[np.take(FLIP_SQUARE, POLICY_FROM_SQUARE), np.take(FLIP_SQUARE, POLICY_TO_SQUARE)]
+# 对称变换编号 0:不变 1:镜像 2:红黑互换 3:两者同时，SYMMETRY_POLICY[t]为变换t下的走法编号置换
+SYMMETRY_POLICY = np.stack([np.arange(POLICY_SIZE), MIRROR_POLICY, FLIP_POLICY, MIRROR_POLICY[FLIP_POLICY]])
+# 红黑互换时的平面顺序: 棋子ID取反即平面顺序反转，当前玩家平面仍在最后(取值另行翻转)
+FLIP_PLANES = list(range(STATE_PLANES - 2, -1, -1)) + [STATE_PLANES - 1]
+
+
+def move_indices(moves):
+    """把(起点格, 终点格)列表批量转换为走法编号数组"""
+    if not moves:
+        return np.zeros(0, dtype=np.int64)
+    moves = np.asarray(moves, dtype=np.int64)
+    return POLICY_INDEX_TABLE[moves[:, 0], moves[:, 1]]
+
+
+def encode_boards(boards, players, out=None):
+    """把一批棋盘编码为神经网络输入
+    
+    :param boards: (N, 90)的棋子ID数组，行优先
+    :param players: (N,)的走棋方数组
+    :param out: 可选，(N, 15, 10, 9)的float32连续数组，结果直接写入其中
+    :return: (N, 15, 10, 9)的float32连续数组
+    """
+    count = len(boards)
+    if out is None:
+        out = np.empty((count, STATE_PLANES, BOARD_ROWS, BOARD_COLS), dtype=np.float32)
+    flat = out.reshape(count, STATE_PLANES, BOARD_ROWS * BOARD_COLS)
+    # 与每个平面的棋子ID比较得到one-hot
+    np.equal(boards[:, None, :], PLANE_PIECE_IDS[None, :, None], out=flat[:, :-1])
+    flat[:, -1] = (np.asarray(players) == 1)[:, None]
+    return out
+
+
+def encode_states(games, out=None):
+    """把多个棋局的get_state()批量编码为一个(N, 15, 10, 9)的连续数组，可以直接作为ChessNet的一个批次"""
+    boards = np.array([game.squares for game in games], dtype=np.int8)[:, BOARD_SQUARES]
+    players = [game.current_player for game in games]
+    return encode_boards(boards, players, out)
+
+
+def pack_positions(boards, players, fullmove_numbers):
+    """把一批局面打包为定长二进制格式
+    
+    :param boards: (N, 10, 9)或(N, 90)的棋子ID数组
+    :param players: (N,)的走棋方数组
+    :param fullmove_numbers: (N,)的回合数数组(与FEN最后一项相同)
+    :return: (N, 48)的uint8数组
+    """
+    boards = np.asarray(boards, dtype=np.int8).reshape(len(boards), BOARD_ROWS * BOARD_COLS)
+    # 棋子ID取低4位(负数为补码)，两格合成一个字节
+    codes = boards.astype(np.uint8) & 0x0F
+    packed = np.empty((len(boards), PACKED_POSITION_SIZE), dtype=np.uint8)
+    packed[:, :45] = (codes[:, 0::2] << 4) | codes[:, 1::2]
+    packed[:, 45] = np.asarray(players) == -1
+    packed[:, 46:] = np.asarray(fullmove_numbers, dtype='<u2').reshape(-1, 1).view(np.uint8)
+    return packed
+
+
+def unpack_positions(packed):
+    """pack_positions的逆操作
+    
+    :param packed: (N, 48)的uint8数组
+    :return: (boards, players, fullmove_numbers)，boards为(N, 10, 9)的int8数组
+    """
+    packed = np.asarray(packed, dtype=np.uint8).reshape(-1, PACKED_POSITION_SIZE)
+    codes = np.empty((len(packed), BOARD_ROWS * BOARD_COLS), dtype=np.int8)
+    codes[:, 0::2] = packed[:, :45] >> 4
+    codes[:, 1::2] = packed[:, :45] & 0x0F
+    # 4位补码还原为有符号的棋子ID
+    boards = np.where(codes > 7, codes - 16, codes).astype(np.int8).reshape(-1, BOARD_ROWS, BOARD_COLS)
+    players = np.where(packed[:, 45] == 1, -1, 1).astype(np.int8)
+    fullmove_numbers = np.ascontiguousarray(packed[:, 46:]).view('<u2').reshape(-1).astype(np.int32)
+    return boards, players, fullmove_numbers
+
+
+def repetition_winner(history, check_history, current_player):
+    """局面重复出现时判定结果: 循环中一方每步都在将军(长将)判负，否则判和
+    
+    :param history: 历史局面哈希序列，最后一个为当前局面，且之前出现过
+    :param check_history: 与history对应，每个局面中走棋方是否被将军
+    :param current_player: 当前局面的走棋方
+    :return: 1/-1为胜方，0为和棋
+    """
+    last = len(history) - 1
+    # 找到上一次出现同一局面的位置，两者之间就是重复的循环
+    start = last - 2
+    while history[start] != history[last]:
+        start -= 2
+    
+    always_checking = {1: True, -1: True}
+    for index in range(start + 1, last + 1):
+        # 走到第index个局面的一方
+        mover = -current_player if (last - index) % 2 == 0 else current_player
+        if not check_history[index]:
+            always_checking[mover] = False
+    
+    if always_checking[1] != always_checking[-1]:
+        return -1 if always_checking[1] else 1
+    return 0
+
+
+class HistoryNode:
+    """不可变的历史局面节点，通过parent指向上一个局面，组成一条从当前局面回溯到开局的链
+    
+    克隆的棋局直接共享同一条链，之后各自的新局面只在自己的分支上追加节点，
+    因此MCTS树和长对局的历史内存随局面数增长，而不是随局面数×对局长度增长。
+    节点上还缓存该局面第一次用到时才计算的合法走法和胜负状态，pop()回到该局面时直接复用。
+    """
+    
+    __slots__ = ('key', 'in_check', 'count', 'irreversible', 'move', 'parent', 'legal_moves', 'status',
+                 'window', 'tail')
+    
+    def __init__(self, key, in_check, parent=None, move=None, irreversible=True):
+        """
+        :param key: 局面的Zobrist哈希
+        :param in_check: 局面中走棋方是否被将军
+        :param parent: 上一个局面的节点，开局(或载入的局面)为None
+        :param move: 走到该局面的撤销信息(起点格, 终点格, 被吃棋子ID)
+        :param irreversible: 走到该局面的一步是否不可逆(吃子或兵/卒前进)，不可逆走法之前的局面不会再出现
+        """
+        self.key = key
+        self.in_check = in_check
+        self.parent = parent
+        self.move = move
+        self.irreversible = irreversible
+        self.legal_moves = None  # 走棋方的合法走法，见ChineseChess._current_legal_moves()
+        self.status = None  # (game_over, winner)，见ChineseChess._game_status()
+        if irreversible or parent is None:
+            # 重复局面只可能出现在最近一次不可逆走法之后，从这里开始新的计数
+            self.window = {key: 1}
+            self.tail = 0
+            self.count = 1
+        else:
+            # window为窗口内截止到某个祖先节点的各局面出现次数(多个节点共享，不修改)，
+            # tail为该祖先之后到本节点的节点数；回溯不超过WINDOW_SNAPSHOT_INTERVAL步
+            self.window = parent.window
+            self.tail = parent.tail + 1
+            self.count = self.window.get(key, 0) + self._tail_count(key, parent, parent.tail) + 1
+            if self.tail >= WINDOW_SNAPSHOT_INTERVAL:
+                self._snapshot()
+    
+    @staticmethod
+    def _tail_count(key, node, steps):
+        """从node开始向上steps个节点中局面key出现的次数"""
+        count = 0
+        for _ in range(steps):
+            if node.key == key:
+                count += 1
+            node = node.parent
+        return count
+    
+    def _snapshot(self):
+        """把window之后的节点(包括自己)并入一个新的计数表"""
+        window = dict(self.window)
+        node = self
+        for _ in range(self.tail):
+            window[node.key] = window.get(node.key, 0) + 1
+            node = node.parent
+        self.window = window
+        self.tail = 0
+    
+    def cycle(self):
+        """返回从上一次出现同一局面到当前局面的(哈希列表, 将军标记列表)，用于repetition_winner()"""
+        keys = [self.key]
+        checks = [self.in_check]
+        node = self.parent
+        while True:
+            keys.append(node.key)
+            checks.append(node.in_check)
+            if node.key == self.key and len(keys) % 2 == 1:
+                break
+            node = node.parent
+        keys.reverse()
+        checks.reverse()
+        return keys, checks
+
 
 class Piece:
     """棋子类,但是只是定义了棋子类型,没有棋子特性"""
@@ -30,103 +371,155 @@ class Piece:
         return piece_names.get((self.piece_type, self.player), ' ')
 
 class ChineseChess:
-    """中国象棋游戏类"""
+    """中国象棋游戏类
     
-    def __init__(self):
-        """初始化棋盘和棋子"""
-        # 棋盘大小: 10行 9列 (实际棋盘是9*10，但为了方便索引，使用10*9)
-        self.board_size = (10, 9)
+    棋盘状态只保存在一个一维填充棋盘 squares 中，另外用 piece_squares
+    记录双方棋子所在的格子、用 king_squares 记录双方将/帅的格子，
+    走子时三者一起增量更新。
+    """
+    
+    def __init__(self, board=None, current_player=1):
+        """初始化棋盘和棋子
         
-        # 初始化空棋盘
-        self.board = np.zeros(self.board_size, dtype=np.int8)
+        :param board: 可选，10x9的棋子ID数组(或嵌套序列)，默认为开局局面
+        :param current_player: board对应局面的走棋方，1为红方，-1为黑方
+        """
+        # 棋盘大小: 10行 9列 (实际棋盘是9*10，但为了方便索引，使用10*9)
+        self.board_size = (BOARD_ROWS, BOARD_COLS)
         
-        # 棋子字典，键为位置(row, col)，值为Piece对象
-        self.pieces = {}
+        # 一维填充棋盘，哨兵格为OFFBOARD，空位为0，其他为棋子ID
+        self.squares = [OFFBOARD] * PADDED_SIZE
         
-        # 红方棋子字典，键为棋子ID，值为Piece对象列表
-        self.red_pieces = {}
+        # 双方棋子所在格子的集合，键为玩家(1/-1)
+        self.piece_squares = {1: set(), -1: set()}
         
-        # 黑方棋子字典，键为棋子ID，值为Piece对象列表
-        self.black_pieces = {}
-
-        # 记录双方的将/帅位置，便于快速检查将军
-        self.king_positions = {1: None, -1: None}
+        # 记录双方的将/帅所在格子，便于快速检查将军
+        self.king_squares = {1: None, -1: None}
         # 初始化棋子
-        self._init_pieces()
+        self._init_pieces(INITIAL_BOARD if board is None else board)
         
         # 当前玩家，1表示红方，-1表示黑方
-        self.current_player = 1
+        self.current_player = current_player
         
-        # 游戏是否结束
-        self.game_over = False
-        self.winner = None
+        # 游戏是否结束(game_over、winner)在第一次查询时才判定，结果缓存在历史节点上
         
-        # 记录所有历史棋盘状态，用于检测重复局面
-        self.history = [self.board.copy()]
+        # 当前局面的64位Zobrist哈希，走子时增量更新
+        self.zobrist_key = self._compute_zobrist_key()
+        
+        # 当前局面的历史节点，沿parent回溯得到所有历史局面的哈希、将军标记和撤销信息，
+        # 用于检测重复局面、判定长将和pop()；克隆时直接共享
+        self.history_node = HistoryNode(self.zobrist_key, self._is_checked(current_player))
+        
+        # 增量维护的状态平面(15, 90)，调用track_state()后才启用
+        self._planes = None
         
         # 记录总步数和双方步数
         self.total_moves = 0
         self.red_moves = 0
         self.black_moves = 0
     
-    def _init_pieces(self):
-        """初始化棋盘上的所有棋子"""
-        # 红方(下方)初始布局
-        self._add_piece(1, 1, (9, 0))  # 车
-        self._add_piece(1, 1, (9, 8))  # 车
-        self._add_piece(2, 1, (9, 1))  # 马
-        self._add_piece(2, 1, (9, 7))  # 马
-        self._add_piece(3, 1, (9, 2))  # 相
-        self._add_piece(3, 1, (9, 6))  # 相
-        self._add_piece(4, 1, (9, 3))  # 仕
-        self._add_piece(4, 1, (9, 5))  # 仕
-        self._add_piece(5, 1, (9, 4))  # 帅
-        self._add_piece(6, 1, (7, 1))  # 炮
-        self._add_piece(6, 1, (7, 7))  # 炮
-        self._add_piece(7, 1, (6, 0))  # 兵
-        self._add_piece(7, 1, (6, 2))  # 兵
-        self._add_piece(7, 1, (6, 4))  # 兵
-        self._add_piece(7, 1, (6, 6))  # 兵
-        self._add_piece(7, 1, (6, 8))  # 兵
-        
-        # 黑方(上方)初始布局
-        self._add_piece(1, -1, (0, 0))  # 车
-        self._add_piece(1, -1, (0, 8))  # 车
-        self._add_piece(2, -1, (0, 1))  # 马
-        self._add_piece(2, -1, (0, 7))  # 马
-        self._add_piece(3, -1, (0, 2))  # 象
-        self._add_piece(3, -1, (0, 6))  # 象
-        self._add_piece(4, -1, (0, 3))  # 士
-        self._add_piece(4, -1, (0, 5))  # 士
-        self._add_piece(5, -1, (0, 4))  # 将
-        self._add_piece(6, -1, (2, 1))  # 炮
-        self._add_piece(6, -1, (2, 7))  # 炮
-        self._add_piece(7, -1, (3, 0))  # 卒
-        self._add_piece(7, -1, (3, 2))  # 卒
-        self._add_piece(7, -1, (3, 4))  # 卒
-        self._add_piece(7, -1, (3, 6))  # 卒
-        self._add_piece(7, -1, (3, 8))  # 卒
+    def _init_pieces(self, board):
+        """按棋子ID数组初始化棋盘上的所有棋子"""
+        for row in range(BOARD_ROWS):
+            for col in range(BOARD_COLS):
+                self.squares[POS_TO_SQUARE[(row, col)]] = 0
+                piece_id = int(board[row][col])
+                if piece_id != 0:
+                    self._add_piece(abs(piece_id), 1 if piece_id > 0 else -1, (row, col))
+    
+    def _set_position(self, squares, current_player):
+        """直接载入一维填充棋盘和走棋方，重建棋子索引(不包括历史记录)
+        
+        供批量环境(vec_chess.VecChineseChess)用一个实例逐局复用走法规则
+        """
+        self.squares = squares
+        self.current_player = current_player
+        self.piece_squares = {1: set(), -1: set()}
+        self.king_squares = {1: None, -1: None}
+        for sq in BOARD_SQUARES.tolist():
+            piece_id = squares[sq]
+            if piece_id != 0:
+                player = 1 if piece_id > 0 else -1
+                self.piece_squares[player].add(sq)
+                if piece_id == 5 * player:
+                    self.king_squares[player] = sq
+        self._board_cache = None
+        self._legal_cache = None
+        self._planes = None
+        # 原来的历史节点属于另一个局面，换一个空节点，避免把合法走法和胜负状态缓存到旧节点上
+        self.history_node = HistoryNode(0, False)
     
     def _add_piece(self, piece_type, player, position):
         """添加棋子到棋盘"""
-        row, col = position
-        piece = Piece(piece_type, player, position)
-        
-        # 更新棋盘
-        self.board[row, col] = piece.id
-        
-        # 更新棋子字典
-        self.pieces[position] = piece
-        
-        # 更新玩家棋子字典
-        player_pieces = self.red_pieces if player == 1 else self.black_pieces
-        if piece_type not in player_pieces:
-            player_pieces[piece_type] = []
-        player_pieces[piece_type].append(piece)
+        sq = POS_TO_SQUARE[position]
+        self.squares[sq] = piece_type * player
+        self.piece_squares[player].add(sq)
         
         # 如果是将/帅，记录位置
         if piece_type == 5:
-            self.king_positions[player] = position
+            self.king_squares[player] = sq
+        self._board_cache = None
+        self._legal_cache = None
+    
+    def _compute_zobrist_key(self):
+        """从头计算当前局面的Zobrist哈希"""
+        key = 0
+        for player in (1, -1):
+            for sq in self.piece_squares[player]:
+                key ^= ZOBRIST_PIECE_KEYS[self.squares[sq] + 7][sq]
+        if self.current_player == -1:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key
+    
+    def symmetry_keys(self):
+        """返回当前局面经过4种对称变换(编号见SYMMETRY_POLICY)后的Zobrist哈希"""
+        keys = [self.zobrist_key, 0, 0, 0]
+        for player in (1, -1):
+            for sq in self.piece_squares[player]:
+                piece_id = self.squares[sq]
+                keys[1] ^= ZOBRIST_PIECE_KEYS[piece_id + 7][MIRROR_SQUARE[sq]]
+                keys[2] ^= ZOBRIST_PIECE_KEYS[7 - piece_id][FLIP_SQUARE[sq]]
+                keys[3] ^= ZOBRIST_PIECE_KEYS[7 - piece_id][FLIP_SQUARE[MIRROR_SQUARE[sq]]]
+        # 红黑互换后走棋方也互换
+        if self.current_player == -1:
+            keys[1] ^= ZOBRIST_BLACK_TO_MOVE
+        else:
+            keys[2] ^= ZOBRIST_BLACK_TO_MOVE
+            keys[3] ^= ZOBRIST_BLACK_TO_MOVE
+        return keys
+    
+    def repetition_count(self):
+        """返回当前局面(包括走棋方)在本局中出现的次数"""
+        return self.history_node.count
+    
+    @property
+    def history(self):
+        """从开局到当前局面的所有局面哈希列表(按需从历史节点链生成)"""
+        return [node.key for node in self._history_nodes()]
+    
+    @property
+    def check_history(self):
+        """与history一一对应，每个历史局面中走棋方是否被将军"""
+        return [node.in_check for node in self._history_nodes()]
+    
+    def _history_nodes(self):
+        """从开局到当前局面的历史节点列表"""
+        nodes = []
+        node = self.history_node
+        while node is not None:
+            nodes.append(node)
+            node = node.parent
+        nodes.reverse()
+        return nodes
+    
+    @property
+    def board(self):
+        """10x9的numpy数组形式的棋盘(只读视图，走子后会重新生成)"""
+        if self._board_cache is None:
+            board = np.array(self.squares, dtype=np.int8)[BOARD_SQUARES].reshape(self.board_size)
+            board.flags.writeable = False
+            self._board_cache = board
+        return self._board_cache
     
     def get_piece_name(self, piece_id):
         """根据棋子ID获取名称"""
@@ -140,13 +533,14 @@ class ChineseChess:
     
     def display_board(self):
         """打印当前棋盘状态"""
+        board = self.board
         print('  ０１２３４５６７８')
         print(' ┌─┬─┬─┬─┬─┬─┬─┬─┐')
         
         for i in range(self.board_size[0]):
             print(f'{i}│', end='')
             for j in range(self.board_size[1]):
-                print(f'{self.get_piece_name(self.board[i, j])}', end='')
+                print(f'{self.get_piece_name(board[i, j])}', end='')
                 if j < self.board_size[1] - 1:
                     print('│', end='')
             print('│')
@@ -171,318 +565,158 @@ class ChineseChess:
         return 0 <= row < self.board_size[0] and 0 <= col < self.board_size[1]
     
     def get_piece(self, pos):
-        """获取指定位置的棋子，如果位置为空则返回None"""
-        if pos in self.pieces:
-            return self.pieces[pos]
-        return None
+        """获取指定位置的棋子，如果位置为空则返回None
+        
+        棋盘上不再常驻Piece对象，这里按需构造一个只读的Piece
+        """
+        sq = POS_TO_SQUARE.get(pos)
+        if sq is None or self.squares[sq] == 0:
+            return None
+        piece_id = self.squares[sq]
+        return Piece(abs(piece_id), 1 if piece_id > 0 else -1, pos)
     
     def get_piece_id(self, pos):
         """获取指定位置的棋子ID"""
-        row, col = pos
-        return self.board[row, col]
+        return self.squares[square_of(pos)]
     
     def is_same_side(self, piece1_id, piece2_id):
         """判断两个棋子是否同边"""
         return piece1_id * piece2_id > 0  # 同符号表示同一方
     
     def get_valid_moves(self, pos):
-        """获取指定位置棋子的所有合法移动"""
-        piece = self.get_piece(pos)
-        if not piece or piece.player != self.current_player:
+        """获取指定位置棋子的所有合法移动(不检查是否送将)"""
+        sq = POS_TO_SQUARE.get(pos)
+        if sq is None or self.squares[sq] * self.current_player <= 0:
             return []
-        
-        valid_moves = []
-        
-        # 根据不同类型的棋子计算合法移动
-        if piece.piece_type == 1:  # 车
-            valid_moves.extend(self._get_rook_moves(piece))
-        elif piece.piece_type == 2:  # 马
-            valid_moves.extend(self._get_knight_moves(piece))
-        elif piece.piece_type == 3:  # 相/象
-            valid_moves.extend(self._get_bishop_moves(piece))
-        elif piece.piece_type == 4:  # 仕/士
-            valid_moves.extend(self._get_advisor_moves(piece))
-        elif piece.piece_type == 5:  # 帅/将
-            valid_moves.extend(self._get_king_moves(piece))
-        elif piece.piece_type == 6:  # 炮
-            valid_moves.extend(self._get_cannon_moves(piece))
-        elif piece.piece_type == 7:  # 兵/卒
-            valid_moves.extend(self._get_pawn_moves(piece))
-        
-        return valid_moves
-    
-    def _get_rook_moves(self, piece):
-        """获取车的合法移动"""
-        row, col = piece.position
-        moves = []
-        
-        # 四个方向: 上、右、下、左
-        directions = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-        
-        for d_row, d_col in directions:
-            for step in range(1, max(self.board_size)):
-                new_row, new_col = row + step*d_row, col + step*d_col
-                new_pos = (new_row, new_col)
-                
-                # 超出边界
-                if not self.is_valid_position(new_pos):
-                    break
-                
-                target_id = self.board[new_row, new_col]
-                
-                # 空位
-                if target_id == 0:
-                    moves.append(new_pos)
-                    continue
-                
-                # 敌方棋子，可以吃
-                if not self.is_same_side(piece.id, target_id):
-                    moves.append(new_pos)
-                
-                # 无论是友方还是敌方棋子，都不能继续前进
-                break
-        
-        return moves
-    
-    def _get_knight_moves(self, piece):
-        """获取马的合法移动"""
-        row, col = piece.position
-        moves = []
-        
-        # 马走"日"，先直后斜
-        knight_moves = [
-            (-2, -1), (-2, 1),  # 上两格，左或右一格
-            (-1, -2), (-1, 2),  # 左两格，上或下一格
-            (1, -2), (1, 2),    # 右两格，上或下一格
-            (2, -1), (2, 1)     # 下两格，左或右一格
-        ]
-        
-        # 马脚位置
-        leg_positions = [
-            (-1, 0), (-1, 0),   # 上两格的马脚
-            (0, -1), (0, 1),    # 左两格的马脚
-            (0, -1), (0, 1),    # 右两格的马脚
-            (1, 0), (1, 0)      # 下两格的马脚
-        ]
-        
-        for i, (d_row, d_col) in enumerate(knight_moves):
-            new_row, new_col = row + d_row, col + d_col
-            new_pos = (new_row, new_col)
-            
-            # 检查是否出界
-            if not self.is_valid_position(new_pos):
-                continue
-            
-            # 检查马脚是否被绊
-            leg_row = row + leg_positions[i][0]
-            leg_col = col + leg_positions[i][1]
-            if self.board[leg_row, leg_col] != 0:
-                continue
-            
-            target_id = self.board[new_row, new_col]
-            
-            # 目标位置为空或敌方棋子
-            if target_id == 0 or not self.is_same_side(piece.id, target_id):
-                moves.append(new_pos)
-        
-        return moves
-    
-    def _get_bishop_moves(self, piece):
-        """获取相/象的合法移动"""
-        row, col = piece.position
-        moves = []
-        
-        # 相/象走田，四个方向
-        directions = [(-2, -2), (-2, 2), (2, -2), (2, 2)]
-        
-        # 象眼位置
-        eye_positions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-        
-        for i, (d_row, d_col) in enumerate(directions):
-            new_row, new_col = row + d_row, col + d_col
-            new_pos = (new_row, new_col)
-            
-            # 检查是否出界或过河
-            if not self.is_valid_position(new_pos):
-                continue
-                
-            # 相不能过河
-            if (piece.player > 0 and new_row < 5) or (piece.player < 0 and new_row > 4):
-                continue
-            
-            # 检查象眼是否被塞
-            eye_row = row + eye_positions[i][0]
-            eye_col = col + eye_positions[i][1]
-            if self.board[eye_row, eye_col] != 0:
-                continue
-            
-            target_id = self.board[new_row, new_col]
-            
-            # 目标位置为空或敌方棋子
-            if target_id == 0 or not self.is_same_side(piece.id, target_id):
-                moves.append(new_pos)
-        
-        return moves
+        return [SQUARE_TO_POS[to] for to in self._piece_targets(sq)]
     
-    def _get_advisor_moves(self, piece):
-        """获取仕/士的合法移动"""
-        row, col = piece.position
-        moves = []
-        
-        # 仕/士走斜线
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+    def _piece_targets(self, sq):
+        """获取指定格子上棋子的所有伪合法目标格子(不检查是否送将)"""
+        squares = self.squares
+        piece_id = squares[sq]
+        player = 1 if piece_id > 0 else -1
+        piece_type = piece_id * player
+        targets = []
+        
+        if piece_type == 1:  # 车
+            for step in ORTHOGONAL_STEPS:
+                to = sq + step
+                while squares[to] == 0:
+                    targets.append(to)
+                    to += step
+                # 敌方棋子，可以吃
+                if squares[to] != OFFBOARD and squares[to] * player < 0:
+                    targets.append(to)
         
-        for d_row, d_col in directions:
-            new_row, new_col = row + d_row, col + d_col
-            new_pos = (new_row, new_col)
-            
-            # 检查是否在九宫格内
-            if not self.is_valid_position(new_pos):
-                continue
-            
-            if piece.player > 0:  # 红方仕
-                if not (7 <= new_row <= 9 and 3 <= new_col <= 5):
+        elif piece_type == 2:  # 马
+            for step, leg in KNIGHT_STEPS:
+                # 检查马脚是否被绊
+                if squares[sq + leg] != 0:
                     continue
-            else:  # 黑方士
-                if not (0 <= new_row <= 2 and 3 <= new_col <= 5):
+                target_id = squares[sq + step]
+                if target_id == 0 or (target_id != OFFBOARD and target_id * player < 0):
+                    targets.append(sq + step)
+        
+        elif piece_type == 3:  # 相/象
+            home = HOME_HALF[player]
+            for step, eye in BISHOP_STEPS:
+                to = sq + step
+                # 相不能过河，检查象眼是否被塞
+                if to not in home or squares[sq + eye] != 0:
                     continue
+                if squares[to] * player <= 0:
+                    targets.append(to)
+        
+        elif piece_type == 4 or piece_type == 5:  # 仕/士、帅/将
+            palace = PALACE[player]
+            for step in (DIAGONAL_STEPS if piece_type == 4 else ORTHOGONAL_STEPS):
+                to = sq + step
+                if to in palace and squares[to] * player <= 0:
+                    targets.append(to)
             
-            target_id = self.board[new_row, new_col]
-            
-            # 目标位置为空或敌方棋子
-            if target_id == 0 or not self.is_same_side(piece.id, target_id):
-                moves.append(new_pos)
-        
-        return moves
-    
-    def _get_king_moves(self, piece):
-        """获取帅/将的合法移动"""
-        row, col = piece.position
-        moves = []
-        
-        # 帅/将走一格（上下左右）
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        
-        for d_row, d_col in directions:
-            new_row, new_col = row + d_row, col + d_col
-            new_pos = (new_row, new_col)
-            
-            # 检查是否在九宫格内
-            if not self.is_valid_position(new_pos):
-                continue
-            
-            if piece.player > 0:  # 红方帅
-                if not (7 <= new_row <= 9 and 3 <= new_col <= 5):
+            # 将帅对面特殊情况 - 允许直接吃对方的将/帅
+            opponent_king = self.king_squares[-player]
+            if piece_type == 5 and opponent_king is not None and (opponent_king - sq) % PADDED_COLS == 0:
+                step = DOWN if opponent_king > sq else UP
+                to = sq + step
+                while squares[to] == 0:
+                    to += step
+                if to == opponent_king:
+                    targets.append(to)
+        
+        elif piece_type == 6:  # 炮
+            for step in ORTHOGONAL_STEPS:
+                to = sq + step
+                # 未翻山，行走规则与车相同
+                while squares[to] == 0:
+                    targets.append(to)
+                    to += step
+                if squares[to] == OFFBOARD:
                     continue
-            else:  # 黑方将
-                if not (0 <= new_row <= 2 and 3 <= new_col <= 5):
-                    continue
-            
-            target_id = self.board[new_row, new_col]
-            
-            # 目标位置为空或敌方棋子
-            if target_id == 0 or not self.is_same_side(piece.id, target_id):
-                moves.append(new_pos)
-        
-        # 将帅对面特殊情况 - 允许直接吃对方的将/帅
-        opponent_king_pos = self.king_positions[-piece.player]
-        if opponent_king_pos and opponent_king_pos[1] == col:  # 同一列
-            # 检查两个将/帅之间是否有棋子
-            min_row = min(row, opponent_king_pos[0])
-            max_row = max(row, opponent_king_pos[0])
-            has_piece_between = False
-            
-            for r in range(min_row + 1, max_row):
-                if self.board[r, col] != 0:
-                    has_piece_between = True
-                    break
-            
-            if not has_piece_between:
-                moves.append(opponent_king_pos)
-        
-        return moves
+                # 找到炮架，翻山后吃遇到的第一个敌方棋子
+                to += step
+                while squares[to] == 0:
+                    to += step
+                if squares[to] != OFFBOARD and squares[to] * player < 0:
+                    targets.append(to)
+        
+        elif piece_type == 7:  # 兵/卒
+            forward = UP if player > 0 else DOWN
+            steps = (forward,) if sq in HOME_HALF[player] else (forward, LEFT, RIGHT)
+            for step in steps:
+                target_id = squares[sq + step]
+                # 空位或敌方棋子，过河后可以左右移动
+                if target_id == 0 or (target_id != OFFBOARD and target_id * player < 0):
+                    targets.append(sq + step)
+        
+        return targets
     
-    def _get_cannon_moves(self, piece):
-        """获取炮的合法移动"""
-        row, col = piece.position
-        moves = []
-        
-        # 四个方向: 上、右、下、左
-        directions = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-        
-        for d_row, d_col in directions:
-            has_platform = False
-            
-            for step in range(1, max(self.board_size)):
-                new_row, new_col = row + step*d_row, col + step*d_col
-                new_pos = (new_row, new_col)
-                
-                # 超出边界
-                if not self.is_valid_position(new_pos):
-                    break
-                
-                target_id = self.board[new_row, new_col]
-                
-                if not has_platform:
-                    # 未翻山，行走规则与车相同
-                    if target_id == 0:
-                        moves.append(new_pos)
-                        continue
-                    else:
-                        # 找到炮架
-                        has_platform = True
-                        continue
-                else:
-                    # 已经翻山，可以吃子
-                    if target_id == 0:
-                        continue
-                    elif not self.is_same_side(piece.id, target_id):
-                        moves.append(new_pos)
-                    
-                    # 无论是否可以吃子，找到棋子后停止
-                    break
-        
-        return moves
+    def _apply_move(self, from_sq, to_sq):
+        """在棋盘上执行移动，返回被吃棋子的ID(没有则为0)"""
+        squares = self.squares
+        piece_id = squares[from_sq]
+        captured_id = squares[to_sq]
+        player = 1 if piece_id > 0 else -1
+        
+        squares[to_sq] = piece_id
+        squares[from_sq] = 0
+        own = self.piece_squares[player]
+        own.remove(from_sq)
+        own.add(to_sq)
+        if captured_id != 0:
+            self.piece_squares[-player].remove(to_sq)
+            if captured_id == -5 * player:
+                self.king_squares[-player] = None
+        if piece_id == 5 * player:
+            self.king_squares[player] = to_sq
+        self._board_cache = None
+        return captured_id
     
-    def _get_pawn_moves(self, piece):
-        """获取兵/卒的合法移动"""
-        row, col = piece.position
-        moves = []
-        
-        if piece.player > 0:  # 红方兵
-            # 未过河，只能前进
-            if row > 4:
-                if row - 1 >= 0:
-                    target_id = self.board[row-1, col]
-                    if target_id == 0 or target_id < 0:  # 空位或敌方棋子
-                        moves.append((row-1, col))
-            else:
-                # 过河后，可以左右移动
-                directions = [(-1, 0), (0, -1), (0, 1)]  # 上、左、右
-                for d_row, d_col in directions:
-                    new_row, new_col = row + d_row, col + d_col
-                    if self.is_valid_position((new_row, new_col)):
-                        target_id = self.board[new_row, new_col]
-                        if target_id == 0 or target_id < 0:  # 空位或敌方棋子
-                            moves.append((new_row, new_col))
-        else:  # 黑方卒
-            # 未过河，只能前进
-            if row < 5:
-                if row + 1 < self.board_size[0]:
-                    target_id = self.board[row+1, col]
-                    if target_id == 0 or target_id > 0:  # 空位或敌方棋子
-                        moves.append((row+1, col))
-            else:
-                # 过河后，可以左右移动
-                directions = [(1, 0), (0, -1), (0, 1)]  # 下、左、右
-                for d_row, d_col in directions:
-                    new_row, new_col = row + d_row, col + d_col
-                    if self.is_valid_position((new_row, new_col)):
-                        target_id = self.board[new_row, new_col]
-                        if target_id == 0 or target_id > 0:  # 空位或敌方棋子
-                            moves.append((new_row, new_col))
-        
-        return moves
+    def _undo_move(self, from_sq, to_sq, captured_id):
+        """撤销 _apply_move 执行的移动"""
+        squares = self.squares
+        piece_id = squares[to_sq]
+        player = 1 if piece_id > 0 else -1
+        
+        squares[from_sq] = piece_id
+        squares[to_sq] = captured_id
+        own = self.piece_squares[player]
+        own.remove(to_sq)
+        own.add(from_sq)
+        if captured_id != 0:
+            self.piece_squares[-player].add(to_sq)
+            if captured_id == -5 * player:
+                self.king_squares[-player] = to_sq
+        if piece_id == 5 * player:
+            self.king_squares[player] = from_sq
+        self._board_cache = None
+    
+    def _is_legal_after(self, from_sq, to_sq, player):
+        """试走一步，检查走完后己方是否未被将军"""
+        captured_id = self._apply_move(from_sq, to_sq)
+        checked = self._is_checked(player)
+        self._undo_move(from_sq, to_sq, captured_id)
+        return not checked
     
     def make_move(self, from_pos, to_pos):
         """移动棋子并更新游戏状态"""
@@ -491,61 +725,28 @@ class ChineseChess:
         if to_pos not in valid_moves:
             return False
         
-        # 获取移动的棋子
-        piece = self.get_piece(from_pos)
-        if not piece:
+        # 检查移动后是否被将军
+        if not self._is_legal_after(POS_TO_SQUARE[from_pos], POS_TO_SQUARE[to_pos], self.current_player):
             return False
         
-        # 保存移动前的状态，便于执行完后恢复
-        to_row, to_col = to_pos
-        captured_id = self.board[to_row, to_col]
-        captured_piece = self.get_piece(to_pos)
-        
-        # 更新棋盘和棋子位置
-        from_row, from_col = from_pos
-        self.board[to_row, to_col] = piece.id
-        self.board[from_row, from_col] = 0
-        
-        # 更新棋子字典
-        self.pieces.pop(from_pos, None)
-        if captured_piece:
-            # 如果吃子，从对应的棋子列表中移除
-            player_pieces = self.black_pieces if captured_piece.player == -1 else self.red_pieces
-            if captured_piece.piece_type in player_pieces:
-                player_pieces[captured_piece.piece_type].remove(captured_piece)
-            if abs(captured_id) == 5:
-                # 如果吃掉的是将/帅，更新其位置
-                self.king_positions[-captured_piece.player] = None
-        
-        # 更新棋子位置信息
-        piece.position = to_pos
-        self.pieces[to_pos] = piece
-        
-        # 如果移动的是将/帅，更新其位置信息
-        if piece.piece_type == 5:
-            self.king_positions[piece.player] = to_pos
+        self.push((from_pos, to_pos))
+        return True
+    
+    def push(self, move):
+        """执行一步合法移动(不做合法性检查)，撤销信息压入栈中，可以用pop()撤销
         
-        # 检查移动后是否被将军
-        if self._is_checked(self.current_player):
-            # 移动导致被将军，撤销移动
-            self.board[from_row, from_col] = piece.id
-            self.board[to_row, to_col] = captured_id
-            piece.position = from_pos
-            self.pieces[from_pos] = piece
-            self.pieces.pop(to_pos, None)
-            
-            # 恢复被吃的棋子
-            if captured_piece:
-                self.pieces[to_pos] = captured_piece
-                player_pieces = self.black_pieces if captured_piece.player == -1 else self.red_pieces
-                if captured_piece.piece_type in player_pieces:
-                    player_pieces[captured_piece.piece_type].append(captured_piece)
-            
-            # 恢复将/帅位置
-            if piece.piece_type == 5:
-                self.king_positions[piece.player] = from_pos
-            
-            return False
+        :param move: (from_pos, to_pos)，必须是get_legal_actions()中的动作
+        """
+        from_sq = POS_TO_SQUARE[move[0]]
+        to_sq = POS_TO_SQUARE[move[1]]
+        piece_id = self.squares[from_sq]
+        undo = (from_sq, to_sq, self.squares[to_sq])
+        captured_id = self._apply_move(from_sq, to_sq)
+        
+        # 增量更新哈希
+        piece_keys = ZOBRIST_PIECE_KEYS[piece_id + 7]
+        self.zobrist_key ^= (piece_keys[from_sq] ^ piece_keys[to_sq]
+                             ^ ZOBRIST_PIECE_KEYS[captured_id + 7][to_sq] ^ ZOBRIST_BLACK_TO_MOVE)
         
         # 更新步数
         self.total_moves += 1
@@ -556,204 +757,288 @@ class ChineseChess:
         
         # 交换玩家
         self.current_player *= -1
+        self._legal_cache = None
+        if self._planes is not None:
+            self._update_planes(from_sq, to_sq, piece_id, captured_id)
+        
+        # 记录当前局面，吃子和兵/卒前进之后不可能回到之前的局面
+        irreversible = captured_id != 0 or (abs(piece_id) == 7 and abs(to_sq - from_sq) != 1)
+        self.history_node = HistoryNode(self.zobrist_key, self._is_checked(self.current_player),
+                                        self.history_node, undo, irreversible)
+        # 是否将死、困毙或重复局面留到is_game_over()/get_winner()时再判定，MCTS的选择阶段不需要生成合法走法
+    
+    def pop(self):
+        """撤销最近一次push()/make_move()的移动，返回被撤销的动作"""
+        node = self.history_node
+        if node.move is None:
+            raise IndexError("没有可以撤销的移动")
+        from_sq, to_sq, captured_id = node.move
+        self.history_node = node.parent
+        self.zobrist_key = node.parent.key
         
-        # 检查对方是否被将死（新的当前玩家）
-        if self._check_game_over(self.current_player):
-            self.game_over = True
-            self.winner = -self.current_player  # 上一个玩家获胜
-        
-        # 记录当前局面
-        self.history.append(self.board.copy())
-        
-        return True
+        self.current_player *= -1
+        self.total_moves -= 1
+        if self.current_player == 1:
+            self.red_moves -= 1
+        else:
+            self.black_moves -= 1
+        
+        self._undo_move(from_sq, to_sq, captured_id)
+        # 回到的局面之前生成过的合法走法直接复用
+        self._legal_cache = node.parent.legal_moves
+        if self._planes is not None:
+            self._update_planes(from_sq, to_sq, self.squares[from_sq], captured_id, undo=True)
+        return (SQUARE_TO_POS[from_sq], SQUARE_TO_POS[to_sq])
+    
+    def _repetition_winner(self):
+        """当前局面重复出现时判定结果，见repetition_winner()"""
+        keys, checks = self.history_node.cycle()
+        return repetition_winner(keys, checks, self.current_player)
     
     def _is_checked(self, player):
         """检查指定玩家是否被将军"""
-        king_pos = self.king_positions[player]
-        if not king_pos:
+        king_sq = self.king_squares[player]
+        if king_sq is None:
             return False
+        return self._is_attacked(king_sq, -player)
+    
+    def _is_attacked(self, sq, attacker):
+        """检查指定格子是否能被attacker一方的棋子吃到
         
-        # 获取对方所有棋子
-        opponent_pieces = self.black_pieces if player == 1 else self.red_pieces
-        
-        # 检查对方每种类型的棋子
-        for piece_type, pieces in opponent_pieces.items():
-            for piece in pieces:
-                moves = []
-                if piece_type == 1:  # 车
-                    moves = self._get_rook_moves(piece)
-                elif piece_type == 2:  # 马
-                    moves = self._get_knight_moves(piece)
-                elif piece_type == 3:  # 相/象
-                    moves = self._get_bishop_moves(piece)
-                elif piece_type == 4:  # 仕/士
-                    moves = self._get_advisor_moves(piece)
-                elif piece_type == 5:  # 帅/将
-                    moves = self._get_king_moves(piece)
-                elif piece_type == 6:  # 炮
-                    moves = self._get_cannon_moves(piece)
-                elif piece_type == 7:  # 兵/卒
-                    moves = self._get_pawn_moves(piece)
-                
-                if king_pos in moves:
+        从目标格子反向查找: 沿四条直线找车、炮和对面的将/帅，
+        在马位上按反向的马脚规则找马，再检查兵/卒所在的格子。
+        结果与生成对方全部走法再查找目标格子完全一致。
+        """
+        squares = self.squares
+        rook = attacker
+        knight = 2 * attacker
+        cannon = 6 * attacker
+        king = 5 * attacker
+        
+        # 车、炮、将帅对面
+        for step in ORTHOGONAL_STEPS:
+            to = sq + step
+            while squares[to] == 0:
+                to += step
+            piece_id = squares[to]
+            if piece_id == OFFBOARD:
+                continue
+            if piece_id == rook or (piece_id == king and (step == UP or step == DOWN)):
+                return True
+            # 越过炮架找炮
+            to += step
+            while squares[to] == 0:
+                to += step
+            if squares[to] == cannon:
+                return True
+        
+        # 马: 马在 sq - step 处，马脚在马的 leg 方向
+        for step, leg in KNIGHT_STEPS:
+            if squares[sq - step] == knight and squares[sq - step + leg] == 0:
+                return True
+        
+        # 兵/卒: 向前吃，过河后可以横向吃
+        pawn = 7 * attacker
+        forward = UP if attacker > 0 else DOWN
+        if squares[sq - forward] == pawn:
+            return True
+        for side in (LEFT, RIGHT):
+            if squares[sq + side] == pawn and sq + side not in HOME_HALF[attacker]:
+                return True
+        
+        # 仕/士、帅/将只在对方九宫内走子，相/象只在对方半场走子，
+        # 正常对局中吃不到己方的将/帅，这里为了规则完整仍然检查
+        if sq in PALACE[attacker]:
+            for step in DIAGONAL_STEPS:
+                if squares[sq - step] == 4 * attacker:
+                    return True
+            for step in ORTHOGONAL_STEPS:
+                if squares[sq - step] == king:
+                    return True
+        if sq in HOME_HALF[attacker]:
+            for step, eye in BISHOP_STEPS:
+                # 右下角格子反向走"田"会越过填充区，需要检查下标
+                if sq - step < PADDED_SIZE and squares[sq - step] == 3 * attacker and squares[sq - eye] == 0:
                     return True
         
         return False
     
-    def _check_game_over(self, player):
-        """检查指定玩家是否被将死或无子可动"""
-        # 首先检查对方的将/帅是否还存在
-        opponent_king_exists = self.king_positions[-player] is not None
+    def _is_checked_by_moves(self, player):
+        """检查指定玩家是否被将军(参考实现): 生成对方所有走法再查找将/帅位置
         
-        # 如果对方的将/帅不存在，游戏结束
-        if not opponent_king_exists:
-            self.winner = player  # 当前玩家获胜
-            return True
+        速度很慢，只用于和 _is_checked 做差分校验
+        """
+        king_sq = self.king_squares[player]
+        if king_sq is None:
+            return False
         
-        # 检查玩家是否被将军
-        if not self._is_checked(player):
-            return False  # 没有被将军，游戏未结束
+        # 检查对方每个棋子的走法是否能吃到将/帅
+        for sq in self.piece_squares[-player]:
+            if king_sq in self._piece_targets(sq):
+                return True
         
-        # 检查是否有任何合法移动可以解除将军
+        return False
+    
+    def _check_game_over(self, player):
+        """检查指定玩家是否已经输棋(将/帅被吃、被将死或无子可动)"""
+        if self.king_squares[player] is None:
+            return True
+        
+        # 被将死或困毙都算输
         return self._no_valid_moves(player)
     
     def _no_valid_moves(self, player):
         """检查指定玩家是否无子可动"""
-        player_pieces = self.red_pieces if player == 1 else self.black_pieces
+        if player == self.current_player:
+            return not self._current_legal_moves()
+        return not self._legal_moves(player)
+    
+    def _current_legal_moves(self):
+        """当前玩家的合法走法(格子编号对的列表)，同一局面只生成一次"""
+        if self._legal_cache is None:
+            self._legal_cache = self.history_node.legal_moves = self._legal_moves(self.current_player)
+        return self._legal_cache
+    
+    def _legal_moves(self, player):
+        """生成指定玩家的所有合法走法，返回(起点格, 终点格)的列表，顺序只由局面决定
         
-        for piece_type, pieces in player_pieces.items():
-            for piece in pieces:
-                from_pos = piece.position
-                valid_moves = self.get_valid_moves(from_pos)
-                
-                for to_pos in valid_moves:
-                    # 尝试移动
-                    to_row, to_col = to_pos
-                    from_row, from_col = from_pos
-                    
-                    # 保存当前状态
-                    captured_id = self.board[to_row, to_col]
-                    captured_piece = self.get_piece(to_pos)
-                    
-                    # 模拟移动
-                    self.board[to_row, to_col] = piece.id
-                    self.board[from_row, from_col] = 0
-                    
-                    # 暂时更新棋子位置
-                    old_pos = piece.position
-                    piece.position = to_pos
-                    self.pieces.pop(from_pos, None)
-                    self.pieces[to_pos] = piece
-                    
-                    # 如果是将/帅，更新位置信息
-                    old_king_pos = None
-                    if piece.piece_type == 5:
-                        old_king_pos = self.king_positions[player]
-                        self.king_positions[player] = to_pos
-                    
-                    # 检查移动后是否仍被将军
-                    still_checked = self._is_checked(player)
-                    
-                    # 恢复棋盘和棋子位置
-                    self.board[from_row, from_col] = piece.id
-                    self.board[to_row, to_col] = captured_id
-                    piece.position = old_pos
-                    self.pieces[from_pos] = piece
-                    self.pieces.pop(to_pos, None)
-                    
-                    # 恢复被吃的棋子
-                    if captured_piece:
-                        self.pieces[to_pos] = captured_piece
-                    
-                    # 恢复将/帅位置
-                    if old_king_pos:
-                        self.king_positions[player] = old_king_pos
-                    
-                    if not still_checked:
-                        return False  # 找到一个有效移动，可以解除将军
-        
-        return True  # 无有效移动可以解除将军
+        先一次性算出将军和牵制信息，只有被牵制的棋子和将/帅的走法需要试走检查，
+        其他走法只需排除会成为对方炮架的落点。被将军时退回逐个试走。
+        """
+        king_sq = self.king_squares[player]
+        if (king_sq is None or king_sq in PALACE[-player] or king_sq in HOME_HALF[-player]
+                or self._is_attacked(king_sq, -player)):
+            return self._legal_moves_by_trial(player)
+        
+        pinned, screen_squares = self._pin_info(king_sq, player)
+        moves = []
+        # 试走会修改棋子集合，先复制一份再遍历；按格子编号排序，同一局面不论经过怎样的走法顺序到达，
+        # 走法的顺序都相同(评估缓存按这个顺序保存先验概率)
+        for from_sq in sorted(self.piece_squares[player]):
+            targets = self._piece_targets(from_sq)
+            if from_sq == king_sq or from_sq in pinned:
+                for to_sq in targets:
+                    if self._is_legal_after(from_sq, to_sq, player):
+                        moves.append((from_sq, to_sq))
+            elif screen_squares:
+                for to_sq in targets:
+                    if to_sq not in screen_squares:
+                        moves.append((from_sq, to_sq))
+            else:
+                for to_sq in targets:
+                    moves.append((from_sq, to_sq))
+        return moves
     
-    def get_state(self):
-        """返回游戏状态，用于AI训练"""
-        # 将棋盘状态转换为适合神经网络的表示形式
-        # 可以为每种棋子类型创建一个平面
-        planes = []
-        
-        # 为每种棋子类型创建一个平面
-        for piece_type in range(-7, 8):
-            if piece_type == 0:
-                continue
-            
-            plane = np.zeros(self.board_size, dtype=np.float32)
-            for i in range(self.board_size[0]):
-                for j in range(self.board_size[1]):
-                    if self.board[i, j] == piece_type:
-                        plane[i, j] = 1
-            
-            planes.append(plane)
+    def _pin_info(self, king_sq, player):
+        """计算未被将军时的牵制信息
         
-        # 添加当前玩家的平面
-        player_plane = np.ones(self.board_size, dtype=np.float32) * (self.current_player == 1)
-        planes.append(player_plane)
+        :return: (pinned, screen_squares)
+            pinned: 走开后可能让己方被将军的棋子所在格子
+                    (车/将帅对面线上的挡子、炮线上的两个炮架、对方马的马脚)
+            screen_squares: 将/帅与对方炮之间的空格，己方棋子走到这里就成了炮架
+        """
+        squares = self.squares
+        rook = -player
+        cannon = -6 * player
+        king = -5 * player
+        pinned = set()
+        screen_squares = set()
+        
+        for step in ORTHOGONAL_STEPS:
+            # 沿直线找出离将/帅最近的三个棋子
+            first = king_sq + step
+            while squares[first] == 0:
+                first += step
+            if squares[first] == OFFBOARD:
+                continue
+            if squares[first] == cannon:
+                # 对方的炮本身也可以是后面另一个炮的炮架，继续往后检查
+                screen_squares.update(range(king_sq + step, first, step))
+            second = first + step
+            while squares[second] == 0:
+                second += step
+            if squares[second] == OFFBOARD:
+                continue
+            if squares[first] * player > 0 and (
+                    squares[second] == rook or (squares[second] == king and (step == UP or step == DOWN))):
+                pinned.add(first)
+                continue
+            third = second + step
+            while squares[third] == 0:
+                third += step
+            if squares[third] == cannon:
+                # 两个炮架中任何一个己方棋子走开都会被炮将军
+                if squares[first] * player > 0:
+                    pinned.add(first)
+                if squares[second] * player > 0:
+                    pinned.add(second)
+        
+        # 己方棋子塞住对方马的马脚
+        knight = -2 * player
+        for step, leg in KNIGHT_STEPS:
+            leg_sq = king_sq - step + leg
+            if squares[king_sq - step] == knight and squares[leg_sq] * player > 0:
+                pinned.add(leg_sq)
+        
+        return pinned, screen_squares
+    
+    def _legal_moves_by_trial(self, player):
+        """逐个试走伪合法走法来生成合法走法(被将军时使用，也作为参考实现)"""
+        moves = []
+        for from_sq in sorted(self.piece_squares[player]):
+            for to_sq in self._piece_targets(from_sq):
+                # 确保移动后不会被将军
+                if self._is_legal_after(from_sq, to_sq, player):
+                    moves.append((from_sq, to_sq))
+        return moves
+    
+    def get_state(self):
+        """返回游戏状态，用于AI训练
         
-        return np.stack(planes)
+        14个棋子平面(棋子ID依次为-7..-1, 1..7)加1个当前玩家平面，形状为(15, 10, 9)
+        """
+        if self._planes is not None:
+            return self._planes.reshape(STATE_PLANES, *self.board_size).copy()
+        return encode_states([self])[0]
+    
+    def track_state(self, enabled=True):
+        """开启后在push()/pop()中增量更新get_state()的平面，不再每次重新编码"""
+        if not enabled:
+            self._planes = None
+        elif self._planes is None:
+            self._planes = self.get_state().reshape(STATE_PLANES, -1)
+    
+    def _update_planes(self, from_sq, to_sq, piece_id, captured_id, undo=False):
+        """增量更新状态平面: 走子(或撤销走子)时只改动起点、终点和当前玩家平面"""
+        planes = self._planes
+        from_index = SQUARE_TO_INDEX[from_sq]
+        to_index = SQUARE_TO_INDEX[to_sq]
+        piece_plane = PIECE_PLANE[piece_id + 7]
+        planes[piece_plane, from_index] = undo
+        planes[piece_plane, to_index] = not undo
+        if captured_id != 0:
+            planes[PIECE_PLANE[captured_id + 7], to_index] = undo
+        planes[-1] = self.current_player == 1
     
     def get_legal_actions(self):
         """返回当前玩家的所有合法动作"""
-        actions = []
-        player_pieces = self.red_pieces if self.current_player == 1 else self.black_pieces
-        
-        for piece_type, pieces in player_pieces.items():
-            for piece in pieces:
-                from_pos = piece.position
-                for to_pos in self.get_valid_moves(from_pos):
-                    # 确保移动后不会被将军
-                    from_row, from_col = from_pos
-                    to_row, to_col = to_pos
-                    
-                    # 保存当前状态
-                    captured_id = self.board[to_row, to_col]
-                    captured_piece = self.get_piece(to_pos)
-                    
-                    # 模拟移动
-                    self.board[to_row, to_col] = piece.id
-                    self.board[from_row, from_col] = 0
-                    
-                    # 暂时更新棋子位置
-                    old_pos = piece.position
-                    piece.position = to_pos
-                    self.pieces.pop(from_pos, None)
-                    self.pieces[to_pos] = piece
-                    
-                    # 如果是将/帅，更新位置信息
-                    old_king_pos = None
-                    if piece.piece_type == 5:
-                        old_king_pos = self.king_positions[self.current_player]
-                        self.king_positions[self.current_player] = to_pos
-                    
-                    # 检查移动后是否被将军
-                    checked = self._is_checked(self.current_player)
-                    
-                    # 恢复棋盘和棋子位置
-                    self.board[from_row, from_col] = piece.id
-                    self.board[to_row, to_col] = captured_id
-                    piece.position = old_pos
-                    self.pieces[from_pos] = piece
-                    self.pieces.pop(to_pos, None)
-                    
-                    # 恢复被吃的棋子
-                    if captured_piece:
-                        self.pieces[to_pos] = captured_piece
-                    
-                    # 恢复将/帅位置
-                    if old_king_pos:
-                        self.king_positions[self.current_player] = old_king_pos
-                    
-                    if not checked:
-                        actions.append((from_pos, to_pos))
-        
-        return actions
+        return [(SQUARE_TO_POS[from_sq], SQUARE_TO_POS[to_sq]) for from_sq, to_sq in self._current_legal_moves()]
+    
+    def legal_move_indices(self):
+        """返回当前玩家所有合法动作的走法编号数组，顺序与get_legal_actions()相同"""
+        return move_indices(self._current_legal_moves())
+    
+    def legal_mask(self, out=None):
+        """返回合法动作掩码，(2086,)的bool数组，下标为策略向量的走法编号
+        
+        :param out: 可选，(2086,)的bool数组，结果直接写入其中
+        """
+        if out is None:
+            out = np.zeros(POLICY_SIZE, dtype=bool)
+        else:
+            out[:] = False
+        out[self.legal_move_indices()] = True
+        return out
     
     def evaluate(self):
         """评估当前局面"""
@@ -764,16 +1049,34 @@ class ChineseChess:
         
         score = 0
         
-        # 计算红方分数
-        for piece_type, pieces in self.red_pieces.items():
-            score += len(pieces) * piece_values.get(piece_type, 0)
-        
-        # 计算黑方分数
-        for piece_type, pieces in self.black_pieces.items():
-            score -= len(pieces) * piece_values.get(piece_type, 0)
+        # 红方加分，黑方减分
+        for player in (1, -1):
+            for sq in self.piece_squares[player]:
+                score += player * piece_values[abs(self.squares[sq])]
         
         return score * self.current_player  # 从当前玩家角度评估
     
+    def _game_status(self):
+        """返回当前局面的(game_over, winner)，每个局面只判定一次"""
+        node = self.history_node
+        if node.status is None:
+            if self._check_game_over(self.current_player):
+                # 走棋方被将死、困毙或将/帅被吃，上一个走棋的玩家获胜
+                node.status = (True, -self.current_player)
+            elif node.count >= REPETITION_LIMIT:
+                node.status = (True, self._repetition_winner())
+            else:
+                node.status = (False, None)
+        return node.status
+    
+    @property
+    def game_over(self):
+        return self._game_status()[0]
+    
+    @property
+    def winner(self):
+        return self._game_status()[1]
+    
     def is_game_over(self):
         """检查游戏是否结束"""
         return self.game_over
@@ -782,34 +1085,95 @@ class ChineseChess:
         """获取赢家，1表示红方，-1表示黑方，0表示平局，None表示未结束"""
         return self.winner
     
+    @classmethod
+    def from_fen(cls, fen):
+        """从象棋FEN字符串创建棋局，例如INITIAL_FEN
+        
+        FEN的棋盘部分从黑方底线(第0行)写到红方底线(第9行)，走棋方为w(红)或b(黑)，
+        最后一项回合数用于恢复双方步数，其余字段可以省略
+        """
+        fields = fen.split()
+        rows = fields[0].split('/')
+        if len(rows) != BOARD_ROWS:
+            raise ValueError(f"FEN棋盘应有{BOARD_ROWS}行: {fen}")
+        
+        board = []
+        for row_text in rows:
+            row = []
+            for char in row_text:
+                if char.isdigit():
+                    row.extend([0] * int(char))
+                elif char.upper() in FEN_PIECE_IDS:
+                    piece_type = FEN_PIECE_IDS[char.upper()]
+                    row.append(piece_type if char.isupper() else -piece_type)
+                else:
+                    raise ValueError(f"FEN中有无法识别的棋子'{char}': {fen}")
+            if len(row) != BOARD_COLS:
+                raise ValueError(f"FEN每行应有{BOARD_COLS}格: {fen}")
+            board.append(row)
+        
+        current_player = -1 if len(fields) > 1 and fields[1] == 'b' else 1
+        fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        game = cls(board, current_player)
+        game._set_move_counts(current_player, fullmove_number)
+        return game
+    
+    def to_fen(self):
+        """返回当前局面的象棋FEN字符串"""
+        rows = []
+        for row in self.board.tolist():
+            row_text = ''
+            empty = 0
+            for piece_id in row:
+                if piece_id == 0:
+                    empty += 1
+                    continue
+                if empty:
+                    row_text += str(empty)
+                    empty = 0
+                letter = FEN_PIECES[abs(piece_id)]
+                row_text += letter if piece_id > 0 else letter.lower()
+            if empty:
+                row_text += str(empty)
+            rows.append(row_text)
+        side = 'w' if self.current_player == 1 else 'b'
+        return f"{'/'.join(rows)} {side} - - 0 {self.black_moves + 1}"
+    
+    @classmethod
+    def from_bytes(cls, data):
+        """从pack_positions/to_bytes的48字节二进制格式创建棋局"""
+        boards, players, fullmove_numbers = unpack_positions(np.frombuffer(data, dtype=np.uint8))
+        game = cls(boards[0], int(players[0]))
+        game._set_move_counts(int(players[0]), int(fullmove_numbers[0]))
+        return game
+    
+    def to_bytes(self):
+        """把当前局面打包为48字节的二进制格式"""
+        return pack_positions(self.board[None], [self.current_player], [self.black_moves + 1]).tobytes()
+    
+    def _set_move_counts(self, current_player, fullmove_number):
+        """按回合数恢复双方步数: 每回合红方先走，黑方走完后回合数加1"""
+        self.black_moves = fullmove_number - 1
+        self.red_moves = self.black_moves + (1 if current_player == -1 else 0)
+        self.total_moves = self.red_moves + self.black_moves
+    
     def clone(self):
-        """深拷贝游戏状态"""
+        """拷贝游戏状态"""
         new_game = ChineseChess.__new__(ChineseChess)
         new_game.board_size = self.board_size
-        new_game.board = self.board.copy()
+        new_game.squares = self.squares[:]
+        new_game.piece_squares = {1: set(self.piece_squares[1]), -1: set(self.piece_squares[-1])}
+        new_game.king_squares = {1: self.king_squares[1], -1: self.king_squares[-1]}
+        new_game._board_cache = self._board_cache
+        new_game._legal_cache = self._legal_cache
         new_game.current_player = self.current_player
-        new_game.game_over = self.game_over
-        new_game.winner = self.winner
-        new_game.history = [board.copy() for board in self.history]
+        # 历史节点(连同其上缓存的合法走法和胜负状态)不可变，直接共享
+        new_game.zobrist_key = self.zobrist_key
+        new_game.history_node = self.history_node
+        new_game._planes = None if self._planes is None else self._planes.copy()
         new_game.total_moves = self.total_moves
         new_game.red_moves = self.red_moves
         new_game.black_moves = self.black_moves
-        
-        # 复制棋子信息
-        new_game.pieces = {}
-        new_game.red_pieces = {}
-        new_game.black_pieces = {}
-        new_game.king_positions = {1: self.king_positions[1], -1: self.king_positions[-1]}
-        
-        for pos, piece in self.pieces.items():
-            new_piece = Piece(piece.piece_type, piece.player, piece.position)
-            new_game.pieces[pos] = new_piece
-            
-            player_pieces = new_game.red_pieces if piece.player == 1 else new_game.black_pieces
-            if piece.piece_type not in player_pieces:
-                player_pieces[piece.piece_type] = []
-            player_pieces[piece.piece_type].append(new_piece)
-        
         return new_game
 
 # 游戏测试代码
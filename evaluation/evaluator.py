@@ -3,9 +3,11 @@ import numpy as np
 import random
 import copy
 from cn_chess import ChineseChess
-from mcts.mcts import mcts_search
+from mcts.mcts import mcts_search, promote_roots
+from mcts.eval_cache import EvaluationCache
 
-def evaluate_model(model, device, num_games=10, opponent='random', opponent_path=None):
+def evaluate_model(model, device, num_games=10, opponent='random', opponent_path=None, reuse_tree=True,
+                   cache=None, time_limit=None, early_stop=True, extension=1.5, inference=None):
     """评估模型性能
     
     参数:
@@ -14,16 +16,27 @@ def evaluate_model(model, device, num_games=10, opponent='random', opponent_path
         num_games: 评估局数
         opponent: 对手类型 ('random', 'past', 'self')
         opponent_path: 对手模型路径 (如果对手类型为'past')
+        reuse_tree: 走子后保留所选走法的子树，作为下一次搜索的根节点
+        cache: 神经网络评估缓存(EvaluationCache)，为None时为本次评估新建一个，各局之间共享
+        time_limit: 每步的搜索时间上限(秒)，为None时只按50次模拟
+        early_stop: 最佳走法已经确定时提前结束搜索，不影响选出的走法
+        extension: 被将军或最好的两个走法价值接近时的搜索预算倍数
+        inference: 网络推理方式，None、'fp32'或'int8'，见mcts_search
     """
     wins = 0
     draws = 0
     losses = 0
+    model.eval()  # 推理模式，见self_play
+    if cache is None:
+        cache = EvaluationCache()
+    search_options = {'time_limit': time_limit, 'early_stop': early_stop, 'extension': extension,
+                      'inference': inference}
     
     # 如果对手是过去的模型版本，加载它
     opponent_model = None
     if opponent == 'past' and opponent_path:
         from models.chess_net import ChessNet
-        opponent_model = ChessNet()
+        opponent_model = ChessNet(model.input_channels, canonical=model.canonical)
         opponent_model.load_state_dict(torch.load(opponent_path, map_location=device))
         opponent_model.to(device)
         opponent_model.eval()
@@ -33,12 +46,17 @@ def evaluate_model(model, device, num_games=10, opponent='random', opponent_path
     for game_idx in range(num_games):
         game = ChineseChess()
         current_player = 1  # 红方先手，被评估的模型总是红方
+        search_roots = {}  # 双方各自的搜索树，键为走棋方
         
         while not game.is_game_over():
             if game.current_player == current_player:
                 # 被评估的模型移动
-                actions, action_probs, _ = mcts_search(game, model, device, num_simulations=50)
+                actions, action_probs, _, root = mcts_search(game, model, device, num_simulations=50,
+                                                             root=search_roots.get(game.current_player),
+                                                             return_root=True, cache=cache, **search_options)
                 best_action = actions[np.argmax(action_probs)]
+                if reuse_tree:
+                    search_roots[game.current_player] = root
             else:
                 # 对手移动
                 if opponent == 'random':
@@ -47,17 +65,23 @@ def evaluate_model(model, device, num_games=10, opponent='random', opponent_path
                     best_action = random.choice(legal_actions)
                 else:
                     # 使用模型对手
-                    actions, action_probs, _ = mcts_search(game, opponent_model, device, num_simulations=50)
+                    actions, action_probs, _, root = mcts_search(game, opponent_model, device, num_simulations=50,
+                                                                 root=search_roots.get(game.current_player),
+                                                                 return_root=True, cache=cache,
+                                                                 **search_options)
                     best_action = actions[np.argmax(action_probs)]
+                    if reuse_tree:
+                        search_roots[game.current_player] = root
             
             game.make_move(best_action[0], best_action[1])
+            search_roots = promote_roots(search_roots, best_action)
         
         # 记录比赛结果
         winner = game.get_winner()
         if winner == current_player:
             wins += 1
             result = "胜利"
-        elif winner is None:
+        elif not winner:  # 0表示重复局面判和
             draws += 1
             result = "和棋"
         else:
@@ -68,4 +92,5 @@ def evaluate_model(model, device, num_games=10, opponent='random', opponent_path
     
     win_rate = wins / num_games
     print(f"评估结果: 胜率={win_rate:.2f}, 胜={wins}, 和={draws}, 负={losses}")
+    print(f"评估缓存: 命中率={cache.stats()['hit_rate']:.2f}, 缓存局面数={len(cache)}")
     return win_rate
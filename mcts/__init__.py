@@ -1,3 +1,7 @@
 # MCTS模块
 from .mcts_node import MCTSNode
-from .mcts import mcts_search
+from .mcts import mcts_search, promote_roots
+from .array_tree import ArrayTree, array_mcts_search
+from .graph_search import GraphTree, graph_mcts_search
+from .eval_cache import EvaluationCache
+from .budget import SearchBudget
@@ -0,0 +1,256 @@
+import numpy as np
+from cn_chess import SQUARE_TO_POS, POS_TO_SQUARE, POLICY_SIZE, POLICY_INDEX_TABLE
+from .batch_eval import VIRTUAL_LOSS, evaluate_batch
+from .budget import SearchBudget
+
+
+class ArrayTree:
+    """结构数组形式的MCTS树
+    
+    每个节点的访问次数、累计价值、先验概率、第一个子节点的下标和子节点数都保存在
+    预分配的NumPy数组中，一个节点的所有子节点占用连续的一段下标，选择子节点时
+    对这一段做一次向量化的PUCT计算和argmax，不再为每个子节点创建Python对象。
+    节点0为根节点，value_sum的视角与MCTSNode相同(走到该节点的一方)。
+    """
+    
+    def __init__(self, capacity=4096):
+        """
+        :param capacity: 预分配的节点数，不够时自动翻倍
+        """
+        self.size = 1  # 已使用的节点数，下标0为根节点
+        self.visits = np.zeros(capacity, dtype=np.int32)
+        self.value_sum = np.zeros(capacity, dtype=np.float64)
+        self.prior = np.zeros(capacity, dtype=np.float32)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)  # -1表示未扩展
+        self.num_children = np.zeros(capacity, dtype=np.int16)
+        # 从父节点走到该节点的动作，保存为起点格和终点格
+        self.from_square = np.zeros(capacity, dtype=np.uint8)
+        self.to_square = np.zeros(capacity, dtype=np.uint8)
+    
+    def _grow(self, required):
+        """扩大所有数组的容量，使其至少能容纳required个节点"""
+        capacity = len(self.visits)
+        while capacity < required:
+            capacity *= 2
+        for name in ('visits', 'value_sum', 'prior', 'first_child', 'num_children', 'from_square', 'to_square'):
+            old = getattr(self, name)
+            new = np.full(capacity, -1, dtype=old.dtype) if name == 'first_child' else np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+    
+    def is_expanded(self, node):
+        return self.first_child[node] >= 0
+    
+    def expand(self, node, legal_moves, policy, priors=None):
+        """为node添加所有合法走法的子节点
+        
+        :param legal_moves: (起点格, 终点格)的列表，即ChineseChess._current_legal_moves()
+        :param policy: 策略网络输出的概率向量
+        :param priors: 与legal_moves对应的先验概率(来自评估缓存)，传入时不再从policy中查找
+        """
+        count = len(legal_moves)
+        start = self.size
+        end = start + count
+        if end > len(self.visits):
+            self._grow(end)
+        
+        if count:
+            moves = np.array(legal_moves, dtype=np.int64)
+            from_sq = moves[:, 0]
+            to_sq = moves[:, 1]
+            if priors is None:
+                priors = policy[POLICY_INDEX_TABLE[from_sq, to_sq]]
+            
+            self.from_square[start:end] = from_sq
+            self.to_square[start:end] = to_sq
+            self.prior[start:end] = priors
+        
+        self.first_child[node] = start
+        self.num_children[node] = count
+        self.size = end
+    
+    def select_child(self, node, c_puct=1.0):
+        """使用PUCT公式选择最佳子节点，返回子节点下标"""
+        start = self.first_child[node]
+        end = start + self.num_children[node]
+        visits = self.visits[start:end]
+        # PUCT公式 = Q(s,a) + c_puct * P(s,a) * √∑_b N(s,b) / (1 + N(s,a))
+        q_values = np.divide(self.value_sum[start:end], visits, out=np.zeros(end - start), where=visits > 0)
+        scores = q_values + c_puct * self.prior[start:end] * (np.sqrt(self.visits[node]) / (1 + visits))
+        return start + int(np.argmax(scores))
+    
+    def move(self, node):
+        """从父节点走到node的动作，格式为(from_pos, to_pos)"""
+        return (SQUARE_TO_POS[int(self.from_square[node])], SQUARE_TO_POS[int(self.to_square[node])])
+    
+    def children(self, node):
+        """node所有子节点的下标数组"""
+        start = self.first_child[node]
+        return np.arange(start, start + self.num_children[node]) if start >= 0 else np.arange(0)
+    
+    def backup(self, search_path, value):
+        """沿搜索路径反向传播叶节点价值
+        
+        :param search_path: 从根到叶的节点下标列表
+        :param value: 叶节点走棋方视角的价值
+        """
+        path = np.array(search_path, dtype=np.int64)
+        # 叶节点记录-value，每上一层取反
+        signs = np.where(np.arange(len(path))[::-1] % 2 == 0, -1.0, 1.0)
+        self.visits[path] += 1
+        self.value_sum[path] += signs * value
+    
+    def promote(self, move):
+        """实际走了move之后，把对应子节点的子树复制为一棵新树(子节点成为新的根节点0)
+        
+        :param move: (from_pos, to_pos)
+        :return: 新的ArrayTree，该移动从未被搜索过时返回None
+        """
+        from_sq = POS_TO_SQUARE[move[0]]
+        to_sq = POS_TO_SQUARE[move[1]]
+        children = self.children(0)
+        match = children[(self.from_square[children] == from_sq) & (self.to_square[children] == to_sq)]
+        if len(match) == 0 or self.visits[match[0]] == 0:
+            return None
+        
+        tree = ArrayTree(capacity=max(1024, len(self.visits)))
+        old_root = int(match[0])
+        tree.visits[0] = self.visits[old_root]
+        tree.value_sum[0] = self.value_sum[old_root]
+        tree.prior[0] = self.prior[old_root]
+        # 按层复制，每个已扩展节点的子节点仍是连续的一段
+        queue = [(old_root, 0)]
+        while queue:
+            old_node, new_node = queue.pop()
+            start = self.first_child[old_node]
+            if start < 0:
+                continue
+            count = int(self.num_children[old_node])
+            new_start = tree.size
+            if new_start + count > len(tree.visits):
+                tree._grow(new_start + count)
+            old_slice = slice(start, start + count)
+            new_slice = slice(new_start, new_start + count)
+            for name in ('visits', 'value_sum', 'prior', 'from_square', 'to_square'):
+                getattr(tree, name)[new_slice] = getattr(self, name)[old_slice]
+            tree.first_child[new_node] = new_start
+            tree.num_children[new_node] = count
+            tree.size = new_start + count
+            # 只有展开过的子节点需要继续复制
+            for offset in np.flatnonzero(self.first_child[old_slice] >= 0).tolist():
+                queue.append((start + offset, new_start + offset))
+        return tree
+    
+    def add_virtual_loss(self, search_path, loss):
+        """批量搜索时暂时把路径上的节点当作已访问且走到这里的一方输棋"""
+        self.visits[search_path] += 1
+        self.value_sum[search_path] -= loss
+    
+    def revert_virtual_loss(self, search_path, loss):
+        """撤销add_virtual_loss()"""
+        self.visits[search_path] -= 1
+        self.value_sum[search_path] += loss
+
+
+def array_mcts_search(game, model, device, num_simulations=100, temperature=1.0, batch_size=1, root=None,
+                      return_root=False, cache=None, budget=None):
+    """使用ArrayTree执行蒙特卡洛树搜索，参数和返回值与mcts_search相同
+    
+    整棵树只使用一个棋局副本，选择阶段用push()向下走，每次模拟结束后用pop()退回根节点。
+    budget为SearchBudget时由它决定模拟次数，否则执行num_simulations次
+    """
+    if budget is None:
+        budget = SearchBudget(num_simulations).start(game)
+    # 每次扩展大约增加40个子节点
+    tree = ArrayTree(capacity=max(1024, ((num_simulations or 0) + 1) * 48)) if root is None else root
+    search_game = game.clone()
+    search_game.track_state()
+    virtual_loss = VIRTUAL_LOSS if batch_size > 1 else 0
+    model_key = cache.model_key(model) if cache is not None else None
+    
+    def root_stats():
+        children = tree.children(0)
+        return tree.visits[children], tree.value_sum[children]
+    
+    simulations = 0
+    while not budget.should_stop(simulations, root_stats):
+        round_size = budget.round_size(simulations, batch_size)
+        simulations += round_size
+        
+        leaves = []  # 每个元素为(搜索路径, 终局价值或None)
+        pending = {}  # 等待网络评估的叶节点 -> 在本轮状态列表中的下标
+        states = []
+        masks = []
+        legal_moves = []
+        position_keys = []
+        
+        for _ in range(round_size):
+            node = 0
+            search_path = [node]
+            
+            # 选择阶段 - 遍历到叶节点
+            while tree.num_children[node] > 0:
+                node = tree.select_child(node)
+                search_path.append(node)
+                search_game.push(tree.move(node))
+            
+            # 如果游戏已结束，使用真实的结果
+            value = None
+            if search_game.is_game_over():
+                winner = search_game.get_winner()
+                value = 0 if winner is None else winner * search_game.current_player
+            elif node not in pending:
+                position_key = cache.position_key(search_game) if cache is not None else None
+                cached = cache.get(model_key, position_key) if cache is not None else None
+                if cached is not None:
+                    tree.expand(node, search_game._current_legal_moves(), None, cached[0])
+                    value = cached[1]
+                else:
+                    pending[node] = len(states)
+                    states.append(search_game.get_state())
+                    masks.append(search_game.legal_mask())
+                    legal_moves.append(search_game._current_legal_moves())
+                    position_keys.append(position_key)
+            leaves.append((search_path, value))
+            
+            if virtual_loss:
+                tree.add_virtual_loss(search_path, virtual_loss)
+            
+            for _ in range(len(search_path) - 1):
+                search_game.pop()
+        
+        if states:
+            policies, values = evaluate_batch(model, device, states, masks)
+            for node, index in pending.items():
+                tree.expand(node, legal_moves[index], policies[index])
+                if cache is not None:
+                    start = tree.first_child[node]
+                    cache.put(model_key, position_keys[index], tree.prior[start:start + len(legal_moves[index])],
+                              values[index])
+        
+        for search_path, value in leaves:
+            if value is None:
+                value = values[pending[search_path[-1]]].item()
+            if virtual_loss:
+                tree.revert_virtual_loss(search_path, virtual_loss)
+            tree.backup(search_path, value)
+    
+    # 根据访问次数计算移动概率
+    children = tree.children(0)
+    visit_counts = tree.visits[children]
+    actions = [tree.move(child) for child in children.tolist()]
+    
+    if temperature == 0:
+        action_probs = np.zeros(len(children), dtype=np.float32)
+        action_probs[np.argmax(visit_counts)] = 1.0
+    else:
+        visit_count_distribution = visit_counts ** (1.0 / temperature)
+        action_probs = visit_count_distribution / np.sum(visit_count_distribution)
+    
+    # 构建完整的策略向量
+    full_policy = np.zeros(POLICY_SIZE)
+    full_policy[POLICY_INDEX_TABLE[tree.from_square[children], tree.to_square[children]]] = action_probs
+    
+    if return_root:
+        return actions, action_probs, full_policy, tree
+    return actions, action_probs, full_policy
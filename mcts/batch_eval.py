@@ -0,0 +1,32 @@
+import torch
+import numpy as np
+
+# 批量收集叶节点时加在路径上的虚拟损失: 访问次数+1、价值-1，让同一批的其他模拟走向别的分支
+VIRTUAL_LOSS = 1.0
+
+def evaluate_batch(model, device, states, masks=None):
+    """用一次前向计算评估一批局面
+    
+    :param states: (K, 15, 10, 9)的状态数组或状态列表
+    :param masks: 可选，(K, 2086)的合法动作掩码(ChineseChess.legal_mask())，传入时只在合法动作上做softmax
+    :return: (policies, values)，(K, 策略维度)的概率数组和(K,)的价值数组(各局面走棋方视角)
+    
+    总是在推理模式下计算: 训练模式的BatchNorm用整批的统计量，叶节点的评估会随同批的其他叶节点变化。
+    调用时model处于训练模式的，计算完恢复训练模式
+    """
+    state_tensor = torch.from_numpy(np.ascontiguousarray(states, dtype=np.float32)).to(device)
+    training = getattr(model, 'training', False)
+    if training:
+        model.eval()
+    try:
+        with torch.no_grad():
+            policy_logits, value_tensor = model(state_tensor)
+            if masks is not None:
+                mask_tensor = torch.from_numpy(np.asarray(masks, dtype=bool)).to(device)
+                policy_logits = policy_logits.masked_fill(~mask_tensor, float('-inf'))
+            policies = torch.softmax(policy_logits, dim=1).cpu().numpy()
+            values = value_tensor.view(-1).cpu().numpy()
+    finally:
+        if training:
+            model.train()
+    return policies, values
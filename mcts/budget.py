@@ -0,0 +1,130 @@
+import math
+import time
+import numpy as np
+
+# 按时间限制搜索时至少执行的模拟次数，保证根节点的子节点有访问次数
+MIN_SIMULATIONS = 2
+
+
+class SearchBudget:
+    """随时可停的搜索预算: 按模拟次数和/或时间限制决定何时结束搜索
+    
+    early_stop为True时，每隔check_interval次模拟检查一次根节点: 访问次数最多的走法领先第二名的
+    次数超过剩余预算能完成的模拟次数时，最终选择已经不会改变，提前结束。
+    关键局面多给预算: 根局面走棋方被将军时预算一开始就乘以extension；预算用完时访问次数最多的
+    两个走法价值相差小于close_margin，再追加一次(extension - 1)倍的预算。
+    """
+    
+    def __init__(self, num_simulations=None, time_limit=None, early_stop=False, extension=1.0, close_margin=0.05,
+                 check_interval=16):
+        """
+        :param num_simulations: 模拟次数上限，None表示只按时间限制
+        :param time_limit: 搜索时间上限(秒)，None表示只按模拟次数
+        :param early_stop: 最佳走法不可能被超过时提前结束
+        :param extension: 关键局面的预算倍数，1.0表示不延长
+        :param close_margin: 两个走法的平均价值相差小于该值时视为接近
+        :param check_interval: 提前结束检查的间隔(模拟次数)
+        """
+        if num_simulations is None and time_limit is None:
+            raise ValueError("num_simulations和time_limit至少要指定一个")
+        self.num_simulations = num_simulations
+        self.time_limit = time_limit
+        self.early_stop = early_stop
+        self.extension = extension
+        self.close_margin = close_margin
+        self.check_interval = check_interval
+        self.simulations = 0  # 结束时实际执行的模拟次数
+        self.stopped_early = False
+    
+    def start(self, game):
+        """开始计时，根据根局面确定本次搜索的预算"""
+        self._start_time = time.perf_counter()
+        factor = self.extension if game._is_checked(game.current_player) else 1.0
+        self._max_simulations = None if self.num_simulations is None else int(self.num_simulations * factor)
+        self._deadline = None if self.time_limit is None else self._start_time + self.time_limit * factor
+        self._extended = self.extension <= 1.0
+        self._next_check = self.check_interval
+        self.simulations = 0
+        self.stopped_early = False
+        return self
+    
+    def remaining(self, simulations):
+        """估计剩余预算还能完成的模拟次数，只有时间限制且尚未模拟时为inf"""
+        remaining = math.inf
+        if self._max_simulations is not None:
+            remaining = self._max_simulations - simulations
+        if self._deadline is not None:
+            now = time.perf_counter()
+            if now >= self._deadline:
+                return 0
+            elapsed = now - self._start_time
+            if simulations > 0 and elapsed > 0:
+                # 按已经达到的模拟速度估计
+                remaining = min(remaining, simulations / elapsed * (self._deadline - now))
+        return remaining
+    
+    def round_size(self, simulations, batch_size):
+        """下一轮收集的叶节点数，不超过剩余预算"""
+        remaining = self.remaining(simulations)
+        if remaining == math.inf:
+            return batch_size
+        return max(1, min(batch_size, int(remaining)))
+    
+    def should_stop(self, simulations, root_stats):
+        """已完成simulations次模拟后是否结束搜索
+        
+        :param root_stats: 无参数函数，返回根节点所有走法的(访问次数数组, 累计价值数组)，
+                           价值为根局面走棋方的视角；只在需要时调用
+        """
+        self.simulations = simulations
+        remaining = self.remaining(simulations)
+        if remaining <= 0:
+            if simulations < MIN_SIMULATIONS and (self._max_simulations is None
+                                                  or simulations < self._max_simulations):
+                # 时间用完时也至少执行MIN_SIMULATIONS次；按次数的预算严格执行指定次数
+                return False
+            if not self._extended and self._values_close(*root_stats()):
+                self._extend()
+                return False
+            return True
+        if self.early_stop and simulations >= self._next_check:
+            self._next_check = simulations + self.check_interval
+            if self._decided(*root_stats(), remaining):
+                self.stopped_early = True
+                return True
+        return False
+    
+    def _extend(self):
+        """追加一次(extension - 1)倍的预算"""
+        self._extended = True
+        if self._max_simulations is not None:
+            self._max_simulations += int(self.num_simulations * (self.extension - 1))
+        if self._deadline is not None:
+            self._deadline += self.time_limit * (self.extension - 1)
+    
+    def _top_two(self, visits):
+        order = np.argsort(visits)[::-1]
+        return order[0], order[1]
+    
+    def _values_close(self, visits, value_sum):
+        """访问次数最多的两个走法都被访问过且平均价值接近"""
+        if len(visits) < 2:
+            return False
+        best, second = self._top_two(visits)
+        if visits[second] == 0:
+            return False
+        return abs(value_sum[best] / visits[best] - value_sum[second] / visits[second]) < self.close_margin
+    
+    def _decided(self, visits, value_sum, remaining):
+        """剩余的模拟全部给第二名也追不上第一名"""
+        if len(visits) < 2:
+            # 根节点尚未扩展时继续搜索，只有一个合法走法时直接结束
+            return len(visits) == 1
+        if not self._extended and self._values_close(visits, value_sum):
+            # 预算用完时还会延长，把追加的部分也算进去
+            if self._max_simulations is not None:
+                remaining += self.num_simulations * (self.extension - 1)
+            else:
+                remaining *= self.extension
+        best, second = self._top_two(visits)
+        return visits[best] - visits[second] > remaining
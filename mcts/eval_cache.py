@@ -0,0 +1,115 @@
+import weakref
+from collections import OrderedDict
+import numpy as np
+from cn_chess import SYMMETRY_POLICY
+from models.inference import weights_version
+
+
+class EvaluationCache:
+    """神经网络评估结果的LRU缓存，可以在多次搜索、多局对弈之间共享
+    
+    键为(模型, 模型版本, 局面Zobrist哈希)，值为(合法移动的先验概率, 局面价值)。
+    先验概率按ChineseChess.get_legal_actions()的顺序(只由局面决定，与到达局面的走法顺序无关)只保存
+    合法移动的部分，价值为局面走棋方的视角。
+    模型版本由参数和缓冲区的原地修改计数得到，optimizer.step()、load_state_dict()
+    等修改权重的操作都会使版本变化，旧版本的缓存项随之失效。
+    
+    symmetric为True时，互为左右镜像或红黑互换的局面共用一项: 局面键取4种对称变换下最小的哈希，
+    先验概率按变换后的走法编号保存，查找时再换回当前局面的走法顺序。对ChessNet(canonical=True)
+    红黑互换的共用是精确的，镜像的共用是近似(网络对镜像不严格对称)。
+    """
+    
+    def __init__(self, capacity=200000, symmetric=False):
+        """
+        :param capacity: 最多缓存的局面数，超出时淘汰最久未使用的项
+        :param symmetric: 对称的局面是否共用缓存项
+        """
+        self.capacity = capacity
+        self.symmetric = symmetric
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # 模型 -> (模型编号, 最近一次看到的模型版本)。用弱引用，模型释放后编号不会被新模型复用
+        self._models = weakref.WeakKeyDictionary()
+        self._next_model_id = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def model_key(self, model):
+        """返回模型当前权重对应的键，权重变化后清除该模型的旧缓存项
+        
+        一次搜索过程中权重不变，每次搜索开始时调用一次即可
+        """
+        version = weights_version(model)
+        if model in self._models:
+            model_id, last_version = self._models[model]
+            if last_version != version:
+                self._remove_model_entries(model_id)
+        else:
+            model_id = self._next_model_id
+            self._next_model_id += 1
+        self._models[model] = (model_id, version)
+        return (model_id, version)
+    
+    def position_key(self, game):
+        """返回局面在get()/put()中使用的键，必须在game处于该局面时调用
+        
+        symmetric为False时即局面的Zobrist哈希；为True时为(4种对称变换下最小的哈希,
+        合法走法在该变换下的走法编号数组)
+        """
+        if not self.symmetric:
+            return game.zobrist_key
+        keys = game.symmetry_keys()
+        transform = min(range(len(keys)), key=keys.__getitem__)
+        return keys[transform], SYMMETRY_POLICY[transform][game.legal_move_indices()]
+    
+    def get(self, model_key, position_key):
+        """查找缓存，命中时返回(先验概率数组, 价值)，否则返回None"""
+        key = (model_key, position_key[0] if self.symmetric else position_key)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if self.symmetric:
+            # 按变换后的走法编号排序保存，换回当前局面的合法走法顺序
+            indices, priors, value = entry
+            return priors[np.searchsorted(indices, position_key[1])], value
+        return entry
+    
+    def put(self, model_key, position_key, priors, value):
+        """保存一个局面的评估结果"""
+        priors = np.array(priors, dtype=np.float32)
+        if self.symmetric:
+            order = np.argsort(position_key[1])
+            key = (model_key, position_key[0])
+            self._entries[key] = (position_key[1][order], priors[order], float(value))
+        else:
+            key = (model_key, position_key)
+            self._entries[key] = (priors, float(value))
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, model=None):
+        """清除指定模型(默认全部)的缓存项"""
+        if model is None:
+            self._entries.clear()
+        elif model in self._models:
+            self._remove_model_entries(self._models.pop(model)[0])
+    
+    def _remove_model_entries(self, model_id):
+        for key in [key for key in self._entries if key[0][0] == model_id]:
+            del self._entries[key]
+    
+    def stats(self):
+        """返回命中统计"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
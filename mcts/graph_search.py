@@ -0,0 +1,231 @@
+import numpy as np
+from cn_chess import POLICY_SIZE
+from .batch_eval import VIRTUAL_LOSS, evaluate_batch
+from .budget import SearchBudget
+
+
+class GraphNode:
+    """置换表中的一个局面，所有走到该局面的路径共享同一个节点
+    
+    节点保存局面本身的信息(合法移动、网络给出的先验概率)和每条出边的统计量。
+    出边的价值只由经过这条边的模拟更新，所以同一局面从不同路径到达时，
+    网络评估和子树的展开是共享的，而每条边的Q值仍然是良定义的路径平均。
+    """
+    
+    __slots__ = ('moves', 'priors', 'edge_visits', 'edge_value_sum', 'visits')
+    
+    def __init__(self, moves, policy, priors=None, indices=None):
+        """
+        :param moves: 合法移动列表，格式为(from_pos, to_pos)
+        :param policy: 策略网络输出的概率向量
+        :param priors: 与moves对应的先验概率(来自评估缓存)，传入时不再从policy中查找
+        :param indices: 与moves对应的走法编号数组(legal_move_indices())，从policy中取先验概率时使用
+        """
+        self.moves = moves
+        if priors is not None:
+            self.priors = np.array(priors, dtype=np.float32)
+        else:
+            self.priors = policy[indices].astype(np.float32)
+        self.edge_visits = np.zeros(len(moves), dtype=np.int32)
+        # 出边的累计价值，从本局面走棋方的角度计算
+        self.edge_value_sum = np.zeros(len(moves), dtype=np.float64)
+        # 局面的总访问次数，网络评估本身算一次，与MCTSNode扩展后的访问次数一致
+        self.visits = 1
+    
+    def select_edge(self, c_puct=1.0):
+        """使用PUCT公式选择出边，返回出边下标"""
+        visits = self.edge_visits
+        # PUCT公式 = Q(s,a) + c_puct * P(s,a) * √∑_b N(s,b) / (1 + N(s,a))
+        q_values = np.divide(self.edge_value_sum, visits, out=np.zeros(len(visits)), where=visits > 0)
+        scores = q_values + c_puct * self.priors * (np.sqrt(self.visits) / (1 + visits))
+        return int(np.argmax(scores))
+
+
+class GraphTree:
+    """以局面Zobrist哈希为键的搜索图
+    
+    只有本局中第一次出现的局面才放入置换表。搜索路径走到一个本局中已经出现过的
+    局面时，这一步构成循环，直接按重复局面规则(长将判负，否则判和)给出价值，
+    不展开也不与其他路径共享，所以搜索图中不会出现环。
+    """
+    
+    def __init__(self):
+        self.nodes = {}  # 局面哈希 -> GraphNode
+        self.evaluations = 0  # 调用网络评估的局面数
+        self.root_game = None  # 当前根局面(副本)，由搜索设置，promote()在它上面走子
+    
+    def promote(self, move):
+        """实际走了move之后继续使用同一张置换表，下一次搜索按新局面的哈希找到根节点
+        
+        表中只保留从新局面出发能到达的节点，其余局面(旧根节点、被吃子等不可逆走法
+        排除的分支)不会再被搜索到，直接删除
+        """
+        if self.root_game is None:
+            return self
+        game = self.root_game.clone()
+        game.push(move)
+        self.root_game = game.clone()
+        # 实际对局中出现过的局面在搜索中总是构成重复局面，不查置换表
+        history_keys = set()
+        history_node = game.history_node
+        while history_node is not None:
+            history_keys.add(history_node.key)
+            if history_node.irreversible:
+                break
+            history_node = history_node.parent
+        node = self.nodes.get(game.zobrist_key)
+        kept = {}
+        if node is not None:
+            # 在同一个棋局上push/pop做深度优先遍历，栈中为(节点, 下一条要检查的出边)
+            kept[game.zobrist_key] = node
+            stack = [(node, 0)]
+            while stack:
+                node, edge = stack[-1]
+                if edge == len(node.moves):
+                    stack.pop()
+                    if stack:
+                        game.pop()
+                    continue
+                stack[-1] = (node, edge + 1)
+                game.push(node.moves[edge])
+                key = game.zobrist_key
+                child = self.nodes.get(key)
+                if child is not None and key not in kept and key not in history_keys:
+                    kept[key] = child
+                    stack.append((child, 0))
+                else:
+                    game.pop()
+        self.nodes = kept
+        return self
+
+
+def graph_mcts_search(game, model, device, num_simulations=100, temperature=1.0, batch_size=1, root=None,
+                      return_root=False, cache=None, budget=None):
+    """在置换表上执行蒙特卡洛树搜索，参数和返回值与mcts_search相同(root为GraphTree)，
+    budget为SearchBudget时由它决定模拟次数，否则执行num_simulations次
+    
+    反向传播规则: 沿本次模拟实际经过的边更新出边的访问次数和价值(每上一层价值取反)，
+    路径上每个局面的总访问次数加1。不同路径到达同一局面时共享网络评估和展开的子图，
+    减少重复的网络调用。
+    """
+    if budget is None:
+        budget = SearchBudget(num_simulations).start(game)
+    graph = GraphTree() if root is None else root
+    graph.root_game = game.clone()
+    nodes = graph.nodes
+    search_game = game.clone()
+    search_game.track_state()
+    root_key = search_game.zobrist_key
+    virtual_loss = VIRTUAL_LOSS if batch_size > 1 else 0
+    model_key = cache.model_key(model) if cache is not None else None
+    
+    def root_stats():
+        node = nodes.get(root_key)
+        if node is None:
+            return np.zeros(0), np.zeros(0)
+        return node.edge_visits, node.edge_value_sum
+    
+    simulations = 0
+    while not budget.should_stop(simulations, root_stats):
+        round_size = budget.round_size(simulations, batch_size)
+        simulations += round_size
+        
+        leaves = []  # 每个元素为(搜索路径, 叶节点哈希, 终局价值或None)，搜索路径为(节点, 出边下标)列表
+        pending = {}  # 等待网络评估的局面哈希 -> 在本轮状态列表中的下标
+        states = []
+        masks = []
+        legal_actions = []
+        legal_indices = []
+        position_keys = []
+        
+        for _ in range(round_size):
+            search_path = []
+            key = root_key
+            value = None
+            
+            # 选择阶段 - 沿置换表中已展开的局面向下走
+            while True:
+                if search_game.is_game_over():
+                    winner = search_game.get_winner()
+                    value = 0 if winner is None else winner * search_game.current_player
+                    break
+                if search_path and search_game.repetition_count() > 1:
+                    # 循环: 按重复局面规则计算价值，不放入置换表
+                    value = search_game._repetition_winner() * search_game.current_player
+                    break
+                node = nodes.get(key)
+                if node is None:
+                    break
+                edge = node.select_edge()
+                search_path.append((node, edge))
+                search_game.push(node.moves[edge])
+                key = search_game.zobrist_key
+            
+            if value is None and key not in pending:
+                position_key = cache.position_key(search_game) if cache is not None else None
+                cached = cache.get(model_key, position_key) if cache is not None else None
+                if cached is not None:
+                    # 评估缓存命中，直接加入置换表
+                    nodes[key] = GraphNode(search_game.get_legal_actions(), None, cached[0])
+                    value = cached[1]
+                else:
+                    # 扩展阶段 - 记录叶节点局面，本轮结束时统一用神经网络评估
+                    pending[key] = len(states)
+                    states.append(search_game.get_state())
+                    masks.append(search_game.legal_mask())
+                    legal_actions.append(search_game.get_legal_actions())
+                    legal_indices.append(search_game.legal_move_indices())
+                    position_keys.append(position_key)
+            leaves.append((search_path, key, value))
+            
+            if virtual_loss:
+                for node, edge in search_path:
+                    node.visits += 1
+                    node.edge_visits[edge] += 1
+                    node.edge_value_sum[edge] -= virtual_loss
+            
+            # 共享棋局退回根节点
+            for _ in range(len(search_path)):
+                search_game.pop()
+        
+        if states:
+            policies, values = evaluate_batch(model, device, states, masks)
+            graph.evaluations += len(states)
+            for key, index in pending.items():
+                nodes[key] = GraphNode(legal_actions[index], policies[index], indices=legal_indices[index])
+                if cache is not None:
+                    cache.put(model_key, position_keys[index], nodes[key].priors, values[index])
+        
+        # 反向传播阶段 - 更新路径上的出边，每上一层价值取反
+        for search_path, key, value in leaves:
+            if value is None:
+                value = values[pending[key]].item()  # 叶节点当前玩家角度的价值
+            for node, edge in reversed(search_path):
+                if virtual_loss:
+                    node.visits -= 1
+                    node.edge_visits[edge] -= 1
+                    node.edge_value_sum[edge] += virtual_loss
+                value = -value
+                node.visits += 1
+                node.edge_visits[edge] += 1
+                node.edge_value_sum[edge] += value
+    
+    # 根据根局面出边的访问次数计算移动概率
+    root_node = nodes[root_key]
+    actions = root_node.moves
+    visit_counts = root_node.edge_visits
+    
+    if temperature == 0:
+        action_probs = np.zeros(len(actions), dtype=np.float32)
+        action_probs[np.argmax(visit_counts)] = 1.0
+    else:
+        visit_count_distribution = visit_counts ** (1.0 / temperature)
+        action_probs = visit_count_distribution / np.sum(visit_count_distribution)
+    
+    # 构建完整的策略向量
+    full_policy = np.zeros(POLICY_SIZE)
+    full_policy[game.legal_move_indices()] = action_probs
+    
+    if return_root:
+        return actions, action_probs, full_policy, graph
+    return actions, action_probs, full_policy
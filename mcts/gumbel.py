@@ -0,0 +1,84 @@
+import math
+import numpy as np
+
+# 价值变换σ(q) = (C_VISIT + max_b N(b)) * C_SCALE * q，q先从[-1, 1]归一化到[0, 1]
+C_VISIT = 50
+C_SCALE = 1.0
+
+
+def _sigma(q_values, max_visits):
+    return (C_VISIT + max_visits) * C_SCALE * (q_values + 1) / 2
+
+
+def completed_q_values(priors, visits, value_sum, root_value):
+    """补全后的Q值: 访问过的走法用平均价值，未访问的走法用先验加权的混合价值
+    
+    :param priors: 根节点所有走法的先验概率
+    :param visits: 对应的访问次数
+    :param value_sum: 对应的累计价值，根局面走棋方视角
+    :param root_value: 根局面的价值估计，根局面走棋方视角
+    """
+    visited = visits > 0
+    q_values = np.zeros(len(visits))
+    q_values[visited] = value_sum[visited] / visits[visited]
+    total_visits = visits.sum()
+    if total_visits == 0:
+        mixed_value = root_value
+    else:
+        weighted_q = np.sum(priors[visited] * q_values[visited]) / max(np.sum(priors[visited]), 1e-12)
+        mixed_value = (root_value + total_visits * weighted_q) / (1 + total_visits)
+    q_values[~visited] = mixed_value
+    return q_values
+
+
+def improved_policy(priors, visits, value_sum, root_value):
+    """改进后的策略 softmax(logits + σ(补全Q值))，作为训练的策略目标"""
+    logits = np.log(np.maximum(priors, 1e-12))
+    scores = logits + _sigma(completed_q_values(priors, visits, value_sum, root_value), visits.max())
+    scores = np.exp(scores - scores.max())
+    return scores / scores.sum()
+
+
+def gumbel_root_search(root, num_simulations, max_actions, simulate, add_noise=True, rng=np.random):
+    """Gumbel top-k + 逐次减半(sequential halving)的根节点搜索
+    
+    从 Gumbel噪声 + logits 最大的max_actions个走法开始，分ceil(log2 k)轮，每轮给剩下的每个走法
+    分配相同的模拟次数，按 g + logits + σ(q) 保留前一半，最后剩下的走法即为选中的走法。
+    模拟次数较少时(如50次)选出的走法和改进策略仍然是对先验策略的改进。
+    
+    :param root: 已扩展的根节点(MCTSNode)
+    :param num_simulations: 总模拟次数，候选走法很多而模拟次数很少时每个候选至少模拟1次，可能略微超出
+    :param max_actions: 初始候选走法数k，不超过模拟次数
+    :param simulate: 函数simulate(child, count)，从根节点的子节点child开始执行count次模拟
+    :param add_noise: 是否加Gumbel噪声，为False时确定性地选择
+    :return: (选中走法在root.moves中的下标, 改进后的策略数组)
+    """
+    priors = np.array(root.priors, dtype=np.float64)
+    logits = np.log(np.maximum(priors, 1e-12))
+    gumbel = rng.gumbel(size=len(priors)) if add_noise else np.zeros(len(priors))
+    # 根局面走棋方视角的价值，根节点记录的是走到根局面一方的价值
+    root_value = -root.value_sum / root.visits if root.visits else 0.0
+    
+    considered = np.argsort(-(gumbel + logits))[:max(1, min(max_actions, num_simulations, len(priors)))]
+    num_phases = max(1, math.ceil(math.log2(len(considered))))
+    remaining = num_simulations
+    for phase in range(num_phases):
+        if phase == num_phases - 1:
+            count = max(1, remaining // len(considered))
+        else:
+            count = max(1, num_simulations // (num_phases * len(considered)))
+        for index in considered.tolist():
+            move = root.moves[index]
+            child = root.children.get(move)
+            if child is None:
+                child = root._create_child(move, root.priors[index])
+            simulate(child, count)
+        remaining -= count * len(considered)
+        
+        visits, value_sum = root.child_statistics()
+        q_values = np.divide(value_sum, visits, out=np.zeros(len(visits)), where=visits > 0)
+        scores = gumbel + logits + _sigma(q_values, visits.max())
+        considered = considered[np.argsort(-scores[considered])][:max(1, len(considered) // 2)]
+    
+    visits, value_sum = root.child_statistics()
+    return int(considered[0]), improved_policy(priors, visits, value_sum, root_value)
@@ -1,47 +1,91 @@
-import torch
 import numpy as np
+from cn_chess import POLICY_SIZE
 from .mcts_node import MCTSNode
+from .array_tree import array_mcts_search
+from .graph_search import graph_mcts_search
+from .batch_eval import VIRTUAL_LOSS, evaluate_batch
+from .parallel_search import parallel_simulate
+from .budget import SearchBudget
+from .gumbel import gumbel_root_search
+from models.inference import get_inference_model
 
-def mcts_search(game, model, device, num_simulations=100, temperature=1.0):
-    """执行蒙特卡洛树搜索"""
-    root = MCTSNode(game)
+def promote_roots(roots, move):
+    """实际走了move之后，把每棵搜索树提升为对应的子树，没有搜索过该移动的树被丢弃
     
-    for _ in range(num_simulations):
-        node = root
-        search_path = [node]
-        
-        # 选择阶段 - 遍历到叶节点
-        while node.is_expanded and node.children:
-            move, node = node.select_child()
-            search_path.append(node)
-        
-        # 如果游戏已结束，使用真实的结果
-        if node.game.is_game_over():
-            value = node.game.get_winner()
-            if value is None:
-                value = 0  # 和棋
-        else:
-            # 扩展阶段 - 如果节点未扩展，使用神经网络评估
-            state = node.game.get_state()
-            state_tensor = torch.FloatTensor(state).unsqueeze(0).to(device)
-            
-            with torch.no_grad():
-                policy_logits, value_tensor = model(state_tensor)
-                policy = torch.softmax(policy_logits, dim=1).squeeze(0).cpu().numpy()
-                value = value_tensor.item()
-            
-            # 扩展节点
-            node.expand(policy)
-        
-        # 反向传播阶段 - 更新路径上所有节点的统计信息
-        for node in reversed(search_path):
-            # 根据当前玩家调整价值
-            node_value = value if node.game.current_player == game.current_player else -value
-            node.update(node_value)
+    :param roots: 字典，值为mcts_search(return_root=True)返回的根节点
+    """
+    promoted = {key: root.promote(move) for key, root in roots.items()}
+    return {key: root for key, root in promoted.items() if root is not None}
+
+def mcts_search(game, model, device, num_simulations=100, temperature=1.0, shared_game=True, backend='node',
+                batch_size=1, root=None, return_root=False, cache=None, num_threads=1, time_limit=None,
+                early_stop=False, extension=1.0, root_policy='puct', gumbel_actions=16, inference=None):
+    """执行蒙特卡洛树搜索
+    
+    参数:
+        shared_game: 为True时整棵树只使用一个棋局副本，选择阶段用push()向下走，
+                     每次模拟结束后用pop()退回根节点，不再为每个子节点拷贝棋局
+        backend: 树的实现，'node'为MCTSNode对象树，'array'为结构数组形式的ArrayTree
+                 (总是使用共享棋局)，模拟次数较多时更快、占用内存更少；'graph'为以局面哈希
+                 为键的置换表GraphTree，经不同走法顺序到达的同一局面共享网络评估和子图
+        batch_size: 每轮收集的叶节点数。大于1时每条路径加虚拟损失使同一轮的模拟分散到
+                    不同分支，一轮的叶节点用一次网络前向计算评估后再统一反向传播；
+                    越大每秒模拟次数越多，但搜索与逐次模拟的结果差别也越大
+        root: 上一次搜索返回的根节点经promote(走法)得到的子树，局面必须与game相同；
+              为None时从空树开始。backend为'array'时为ArrayTree，为'graph'时为GraphTree
+        return_root: 为True时额外返回搜索树的根节点，走子后用root.promote(action)复用子树
+        cache: EvaluationCache，命中的局面不再调用网络，可以在多次搜索之间共享
+        num_threads: 大于1时使用树并行搜索(只支持'node'，其他backend抛出ValueError)，多个线程带虚拟损失同时在同一棵树上
+                     选择，叶节点请求汇总到一个批量评估线程，忽略shared_game和batch_size
+        time_limit: 搜索时间上限(秒)，与num_simulations同时给出时先到者为准，num_simulations可以为None
+        early_stop: 访问次数最多的走法在剩余预算内不可能被超过时提前结束，按访问次数选最佳走法时
+                    结果不变；但访问次数分布会不同，收集训练数据时不要开启
+        extension: 关键局面(被将军、最好的两个走法价值接近)的预算倍数，见SearchBudget
+        root_policy: 根节点的选择方式。'puct'为按PUCT选择、按访问次数给出移动概率；'gumbel'为
+                     Gumbel top-k + 逐次减半(只支持'node'且单线程，必须给出num_simulations，
+                     指定time_limit、early_stop或extension时抛出ValueError)，
+                     action_probs为选中走法的one-hot，full_policy为改进后的策略，模拟次数很少时
+                     也能作为训练目标。temperature为0时不加Gumbel噪声
+        gumbel_actions: root_policy为'gumbel'时的初始候选走法数
+        inference: 网络推理方式。None为直接调用model；'fp32'/'int8'为用models.inference导出的CPU推理模型
+                   (折叠BN、channels_last、TorchScript，'int8'另外量化全连接层)，导出结果在权重不变时复用，
+                   此时忽略device，在CPU上计算
+    """
+    if inference is not None:
+        model = get_inference_model(model, inference)
+        device = 'cpu'
+    
+    if num_threads > 1 and backend != 'node':
+        raise ValueError("num_threads大于1的树并行搜索只支持backend='node'")
+    if root_policy == 'gumbel':
+        if backend != 'node' or num_threads > 1:
+            raise ValueError("root_policy='gumbel'只支持backend='node'的单线程搜索")
+        if num_simulations is None or time_limit is not None or early_stop or extension != 1.0:
+            # 逐次减半事先按总模拟次数分配各轮的预算，不能随时停止或延长
+            raise ValueError("root_policy='gumbel'只按num_simulations搜索，不支持time_limit、early_stop和extension")
+        return _gumbel_search(game, model, device, num_simulations, temperature, batch_size, root, return_root,
+                              cache, gumbel_actions)
+    
+    budget = SearchBudget(num_simulations, time_limit, early_stop, extension).start(game)
+    if backend == 'array':
+        return array_mcts_search(game, model, device, num_simulations, temperature, batch_size, root, return_root,
+                                 cache, budget)
+    if backend == 'graph':
+        return graph_mcts_search(game, model, device, num_simulations, temperature, batch_size, root, return_root,
+                                 cache, budget)
+    
+    if root is None:
+        root = MCTSNode(game)
+    else:
+        root.game = game
+    if num_threads > 1:
+        parallel_simulate(root, game, model, device, budget, num_threads, cache)
+    else:
+        _simulate(root, game, model, device, budget, shared_game, batch_size, cache)
     
     # 根据访问次数计算移动概率
-    visit_counts = np.array([child.visits for child in root.children.values()])
-    actions = list(root.children.keys())
+    actions, visit_counts = root.child_visits()
+    visit_counts = np.array(visit_counts)
     
     if temperature == 0:  # 确定性选择
         best_idx = np.argmax(visit_counts)
@@ -54,10 +98,127 @@ def mcts_search(game, model, device, num_simulations=100, temperature=1.0):
         action_probs = visit_count_distribution / np.sum(visit_count_distribution)
     
     # 构建完整的策略向量
-    full_policy = np.zeros(2086)  # 与策略头输出维度匹配
-    for action, prob in zip(actions, action_probs):
-        idx = root.move_to_index(action)
-        if idx < len(full_policy):
-            full_policy[idx] = prob
+    full_policy = np.zeros(POLICY_SIZE)  # 与策略头输出维度匹配
+    full_policy[game.legal_move_indices()] = action_probs
+    
+    if return_root:
+        return actions, action_probs, full_policy, root
+    return actions, action_probs, full_policy
+
+def _gumbel_search(game, model, device, num_simulations, temperature, batch_size, root, return_root, cache,
+                   max_actions):
+    """根节点使用Gumbel top-k + 逐次减半的搜索，参数和返回值见mcts_search"""
+    if root is None:
+        root = MCTSNode(game)
+    else:
+        root.game = game
+    if not root.is_expanded:
+        # 先扩展根节点，得到先验概率和根局面的价值
+        _simulate(root, game, model, device, SearchBudget(1).start(game), True, batch_size, cache)
+        num_simulations -= 1
     
+    def simulate(child, count):
+        """从根节点的子节点开始模拟，再把访问次数和价值补到根节点上"""
+        child_game = game.clone()
+        child_game.push(child.move)
+        value_before = child.value_sum
+        _simulate(child, child_game, model, device, SearchBudget(count).start(child_game), True, batch_size, cache)
+        root.visits += count
+        root.value_sum -= child.value_sum - value_before
+    
+    best_idx, policy = gumbel_root_search(root, num_simulations, max_actions, simulate, add_noise=temperature != 0)
+    actions = root.moves
+    action_probs = np.zeros(len(actions), dtype=np.float32)
+    action_probs[best_idx] = 1.0
+    full_policy = np.zeros(POLICY_SIZE)
+    full_policy[game.legal_move_indices()] = policy
+    
+    if return_root:
+        return actions, action_probs, full_policy, root
     return actions, action_probs, full_policy
+
+def _simulate(root, game, model, device, budget, shared_game, batch_size, cache):
+    """在root上执行模拟直到预算(SearchBudget)用完(单线程)，参数含义见mcts_search"""
+    search_game = None
+    if shared_game:
+        search_game = game.clone()
+        search_game.track_state()  # 走子时增量更新状态平面，叶节点不用重新编码
+    virtual_loss = VIRTUAL_LOSS if batch_size > 1 else 0
+    model_key = cache.model_key(model) if cache is not None else None
+    
+    simulations = 0
+    while not budget.should_stop(simulations, root.child_statistics):
+        round_size = budget.round_size(simulations, batch_size)
+        simulations += round_size
+        
+        leaves = []  # 每个元素为(搜索路径, 终局价值或None)
+        pending = {}  # 等待网络评估的叶节点 -> 在本轮状态列表中的下标
+        states = []
+        masks = []
+        legal_actions = []
+        legal_indices = []
+        position_keys = []
+        
+        for _ in range(round_size):
+            node = root
+            search_path = [node]
+            
+            # 选择阶段 - 遍历到叶节点
+            while node.is_expanded and node.moves:
+                move, node = node.select_child()
+                search_path.append(node)
+                if shared_game:
+                    search_game.push(move)
+            
+            leaf_game = search_game if shared_game else node.game
+            
+            # 如果游戏已结束，使用真实的结果
+            value = None
+            if leaf_game.is_game_over():
+                winner = leaf_game.get_winner()
+                # 转换为叶节点当前玩家角度的价值
+                value = 0 if winner is None else winner * leaf_game.current_player
+            elif node not in pending:
+                position_key = cache.position_key(leaf_game) if cache is not None else None
+                cached = cache.get(model_key, position_key) if cache is not None else None
+                if cached is not None:
+                    # 评估缓存命中，直接扩展
+                    node.expand(None, search_game, leaf_game.get_legal_actions(), cached[0])
+                    value = cached[1]
+                else:
+                    # 扩展阶段 - 记录叶节点局面，本轮结束时统一用神经网络评估
+                    pending[node] = len(states)
+                    states.append(leaf_game.get_state())
+                    masks.append(leaf_game.legal_mask())
+                    legal_actions.append(leaf_game.get_legal_actions())
+                    legal_indices.append(leaf_game.legal_move_indices())
+                    position_keys.append(position_key)
+            leaves.append((search_path, value))
+            
+            if virtual_loss:
+                for path_node in search_path:
+                    path_node.add_virtual_loss(virtual_loss)
+            
+            # 共享棋局退回根节点
+            if shared_game:
+                for _ in range(len(search_path) - 1):
+                    search_game.pop()
+        
+        if states:
+            policies, values = evaluate_batch(model, device, states, masks)
+            # 扩展节点
+            for node, index in pending.items():
+                node.expand(policies[index], search_game, legal_actions[index], indices=legal_indices[index])
+                if cache is not None:
+                    cache.put(model_key, position_keys[index], node.priors, values[index])
+        
+        # 反向传播阶段 - 更新路径上所有节点的统计信息
+        # 每个节点记录走到该节点一方的价值，所以每上一层价值取反
+        for search_path, value in leaves:
+            if value is None:
+                value = values[pending[search_path[-1]]].item()  # 叶节点当前玩家角度的价值
+            for node in reversed(search_path):
+                if virtual_loss:
+                    node.revert_virtual_loss(virtual_loss)
+                value = -value
+                node.update(value)
@@ -1,76 +1,130 @@
 import numpy as np
+from cn_chess import MOVE_TO_INDEX
 
 class MCTSNode:
     """蒙特卡洛树搜索节点"""
     def __init__(self, game, parent=None, move=None, prior=0):
-        self.game = game
+        self.game = game  # 共享棋局模式下子节点为None
         self.parent = parent
         self.move = move  # 从父节点到此节点的移动，格式为(from_pos, to_pos)
-        self.children = {}  # 子节点，键为移动，值为节点
+        self.children = {}  # 已访问过的子节点，键为移动，值为节点
+        # 扩展时只记录所有合法移动及其先验概率，子节点在第一次被选中时才创建
+        self.moves = []
+        self.priors = []
+        self.child_games = False  # 子节点是否各自保存棋局副本(非共享棋局模式)
         
         self.visits = 0  # 访问次数
-        self.value_sum = 0.0  # 累计价值
+        self.value_sum = 0.0  # 累计价值，从走到此节点的一方(父节点的当前玩家)的角度计算
         self.prior = prior  # 先验概率
         
         self.is_expanded = False
     
     def select_child(self, c_puct=1.0):
-        """使用PUCT公式选择最佳子节点"""
+        """使用PUCT公式选择最佳子节点，第一次选中的子节点在这里创建"""
         best_score = -float('inf')
-        best_move = None
+        best_index = None
+        sqrt_visits = np.sqrt(self.visits)
         
-        for move, child in self.children.items():
+        for index, move in enumerate(self.moves):
             # PUCT公式 = Q(s,a) + c_puct * P(s,a) * √∑_b N(s,b) / (1 + N(s,a))
-            if child.visits > 0:
+            child = self.children.get(move)
+            if child is not None and child.visits > 0:
                 q_value = child.value_sum / child.visits
+                child_visits = child.visits
             else:
                 q_value = 0
+                child_visits = 0
                 
             # 计算UCB分数
-            exploration = c_puct * child.prior * (np.sqrt(self.visits) / (1 + child.visits))
+            exploration = c_puct * self.priors[index] * (sqrt_visits / (1 + child_visits))
             score = q_value + exploration
             
             if score > best_score:
                 best_score = score
-                best_move = move
+                best_index = index
         
-        return best_move, self.children[best_move]
+        best_move = self.moves[best_index]
+        child = self.children.get(best_move)
+        if child is None:
+            child = self._create_child(best_move, self.priors[best_index])
+        return best_move, child
     
-    def expand(self, policy):
-        """扩展节点，添加所有可能的子节点"""
-        legal_actions = self.game.get_legal_actions()
+    def _create_child(self, move, prior):
+        """创建子节点，非共享棋局模式下同时拷贝棋局并走子"""
+        next_game = None
+        if self.child_games:
+            next_game = self.game.clone()
+            next_game.push(move)
+        child = MCTSNode(next_game, parent=self, move=move, prior=prior)
+        self.children[move] = child
+        return child
+    
+    def promote(self, move):
+        """实际走了move之后，返回对应的子树作为下一步搜索的根节点
         
-        # 为每个合法移动创建子节点
-        for move in legal_actions:
-            if move not in self.children:
-                # 创建新游戏状态
-                next_game = self.game.clone()
-                next_game.make_move(move[0], move[1])
-                
-                # 获取此移动的先验概率（从策略网络）
-                move_idx = self.move_to_index(move)
-                prior = policy[move_idx] if move_idx < len(policy) else 0.001
-                
-                # 创建子节点
-                self.children[move] = MCTSNode(next_game, parent=self, move=move, prior=prior)
+        子节点与本节点断开，树的其余部分随本节点一起释放；该移动从未被搜索过时返回None
+        """
+        child = self.children.get(move)
+        if child is not None:
+            child.parent = None
+        return child
+    
+    def child_visits(self):
+        """返回(所有合法移动, 对应的访问次数)，未访问过的移动次数为0"""
+        return self.moves, [self.children[move].visits if move in self.children else 0 for move in self.moves]
+    
+    def child_statistics(self):
+        """返回所有合法移动的(访问次数数组, 累计价值数组)，价值为本节点走棋方的视角"""
+        children = [self.children.get(move) for move in self.moves]
+        visits = np.array([0 if child is None else child.visits for child in children])
+        value_sum = np.array([0.0 if child is None else child.value_sum for child in children])
+        return visits, value_sum
+    
+    def expand(self, policy, game=None, moves=None, priors=None, indices=None):
+        """扩展节点，记录所有合法移动及其先验概率
+        
+        子节点推迟到第一次被选中时才创建。如果传入game(由搜索过程用push/pop移动的共享棋局)，
+        子节点不再各自保存棋局副本，game属性为None。
+        moves为本节点的合法移动，批量评估时共享棋局已经退回根节点，需要事先记录后传入，
+        从policy中取先验概率时还要同时传入对应的走法编号数组indices(legal_move_indices())；
+        priors为与moves对应的先验概率(来自评估缓存)，传入时不再从policy中查找
+        """
+        self.child_games = game is None
+        if moves is None:
+            position = self.game if game is None else game
+            moves = position.get_legal_actions()
+            if priors is None:
+                indices = position.legal_move_indices()
+        self.moves = moves
+        
+        if priors is not None:
+            self.priors = list(priors)
+        else:
+            # 获取每个移动的先验概率（从策略网络），按走法编号一次取出
+            self.priors = np.asarray(policy)[indices].tolist()
         
         self.is_expanded = True
     
     @staticmethod
     def move_to_index(move):
-        """将移动转换为策略向量的索引"""
-        from_pos, to_pos = move
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        # 将移动映射到一维索引
-        board_size = 10 * 9
-        return from_row * 9 + from_col + (to_row * 9 + to_col) * board_size
+        """将移动转换为策略向量的索引(0-2085的走法编号，见cn_chess.MOVE_TO_INDEX)"""
+        return MOVE_TO_INDEX[move]
     
     def update(self, value):
         """更新节点统计信息"""
         self.visits += 1
         self.value_sum += value
     
+    def add_virtual_loss(self, loss):
+        """批量搜索时暂时把该节点当作已访问且走到这里的一方输棋，使同一批模拟避开这条路径"""
+        self.visits += 1
+        self.value_sum -= loss
+    
+    def revert_virtual_loss(self, loss):
+        """撤销add_virtual_loss()"""
+        self.visits -= 1
+        self.value_sum += loss
+    
     def get_value(self):
         """获取节点的平均价值"""
         if self.visits == 0:
@@ -0,0 +1,194 @@
+import queue
+import threading
+from .batch_eval import VIRTUAL_LOSS, evaluate_batch
+
+# 节点锁的数量。按id(节点)分段加锁，不必为每个节点创建一个锁对象
+NUM_NODE_LOCKS = 1024
+
+
+class BatchEvaluator:
+    """批量评估线程: 搜索线程提交叶节点局面后阻塞等待，评估线程把同时等待的请求合成一批，
+    用一次网络前向计算得到结果"""
+    
+    def __init__(self, model, device, max_batch_size):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.batches = 0  # 网络前向计算的次数
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def evaluate(self, state, mask=None):
+        """评估一个局面，返回(policy, value)，在评估线程算完之前阻塞
+        
+        :param mask: 合法动作掩码(ChineseChess.legal_mask())，一批请求要么都传要么都不传
+        """
+        request = {'state': state, 'mask': mask, 'done': threading.Event()}
+        self._requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['policy'], request['value']
+    
+    def close(self):
+        self._requests.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            # 取出所有已经在等待的请求
+            batch = [request]
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._requests.put(None)
+                    break
+                batch.append(request)
+            
+            try:
+                masks = None if batch[0]['mask'] is None else [request['mask'] for request in batch]
+                policies, values = evaluate_batch(self.model, self.device, [request['state'] for request in batch],
+                                                  masks)
+                self.batches += 1
+                for index, request in enumerate(batch):
+                    request['policy'] = policies[index]
+                    request['value'] = values[index].item()
+            except Exception as error:
+                for request in batch:
+                    request['error'] = error
+            for request in batch:
+                request['done'].set()
+
+
+class _PendingLeaf:
+    """正在等待网络评估的叶节点，其他线程走到同一叶节点时等待它扩展完成"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.expanded = False
+
+
+def parallel_simulate(root, game, model, device, budget, num_threads, cache=None):
+    """树并行搜索: num_threads个线程在root上执行模拟，直到预算(SearchBudget)用完
+    
+    每个线程有自己的棋局副本，用push/pop在共享的MCTSNode树上移动。
+    节点的统计量(visits/value_sum)由父节点的锁保护(根节点用自己的锁)，
+    节点的扩展和子节点的选择由节点自己的锁保护；同一个叶节点只由第一个到达的线程
+    提交评估，其他线程等它扩展后继续向下选择。选择时给路径上的节点加虚拟损失，
+    反向传播时撤销，使各线程分散到不同分支。
+    """
+    locks = [threading.Lock() for _ in range(NUM_NODE_LOCKS)]
+    
+    def node_lock(node):
+        return locks[id(node) % NUM_NODE_LOCKS]
+    
+    def stats_lock(node):
+        return node_lock(node.parent if node.parent is not None else node)
+    
+    evaluator = BatchEvaluator(model, device, max_batch_size=num_threads)
+    model_key = cache.model_key(model) if cache is not None else None
+    cache_lock = threading.Lock()
+    pending = {}  # 叶节点 -> _PendingLeaf
+    counter = {'started': 0}
+    counter_lock = threading.Lock()
+    errors = []
+    
+    def run_simulation(search_game):
+        node = root
+        search_path = [node]
+        with stats_lock(node):
+            node.add_virtual_loss(VIRTUAL_LOSS)
+        
+        # 选择阶段 - 遍历到叶节点
+        value = None
+        while True:
+            if search_game.is_game_over():
+                winner = search_game.get_winner()
+                value = 0 if winner is None else winner * search_game.current_player
+                break
+            claim = None
+            with node_lock(node):
+                if node.is_expanded:
+                    move, child = node.select_child()
+                    # 子节点的统计量由本节点的锁保护
+                    child.add_virtual_loss(VIRTUAL_LOSS)
+                elif node in pending:
+                    claim = pending[node]
+                else:
+                    own_claim = pending[node] = _PendingLeaf()
+                    break
+            if claim is not None:
+                # 其他线程正在评估这个叶节点，等它扩展后继续向下选择
+                claim.done.wait()
+                if not claim.expanded:
+                    raise RuntimeError("叶节点评估失败")
+                continue
+            search_path.append(child)
+            search_game.push(move)
+            node = child
+        
+        if value is None:
+            # 扩展阶段 - 查评估缓存或提交给批量评估线程
+            try:
+                legal_actions = search_game.get_legal_actions()
+                cached = None
+                if cache is not None:
+                    position_key = cache.position_key(search_game)
+                    with cache_lock:
+                        cached = cache.get(model_key, position_key)
+                if cached is not None:
+                    policy, priors, indices, value = None, cached[0], None, cached[1]
+                else:
+                    policy, value = evaluator.evaluate(search_game.get_state(), search_game.legal_mask())
+                    priors = None
+                    indices = search_game.legal_move_indices()
+                with node_lock(node):
+                    node.expand(policy, search_game, legal_actions, priors, indices)
+                    del pending[node]
+                if cache is not None and cached is None:
+                    with cache_lock:
+                        cache.put(model_key, position_key, node.priors, value)
+                own_claim.expanded = True
+            finally:
+                # 出错时也要唤醒等待同一叶节点的线程
+                own_claim.done.set()
+        
+        for _ in range(len(search_path) - 1):
+            search_game.pop()
+        
+        # 反向传播阶段 - 撤销虚拟损失并更新统计信息，每上一层价值取反
+        for path_node in reversed(search_path):
+            value = -value
+            with stats_lock(path_node):
+                path_node.revert_virtual_loss(VIRTUAL_LOSS)
+                path_node.update(value)
+    
+    def worker():
+        search_game = game.clone()
+        search_game.track_state()
+        try:
+            while True:
+                with counter_lock:
+                    # 根节点统计量不加锁读取，只用于判断是否结束，正在进行的模拟带着虚拟损失
+                    if errors or budget.should_stop(counter['started'], root.child_statistics):
+                        return
+                    counter['started'] += 1
+                run_simulation(search_game)
+        except Exception as error:
+            errors.append(error)
+    
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    evaluator.close()
+    if errors:
+        raise errors[0]
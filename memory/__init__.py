@@ -1,2 +1,3 @@
 # 内存模块
-from .replay_buffer import ReplayBuffer
\ No newline at end of file
+from .replay_buffer import ReplayBuffer
+from .samples import compress_sample, expand_samples
@@ -1,18 +1,82 @@
-from collections import deque
-import random
+import numpy as np
+from cn_chess import BOARD_ROWS, BOARD_COLS, POLICY_SIZE, encode_boards
+
+# 每个样本最多保存的策略项数，合法走法更多时只保留概率最大的部分
+POLICY_SLOTS = 128
 
 class ReplayBuffer:
-    """经验回放缓冲区"""
-    def __init__(self, capacity):
-        self.buffer = deque(maxlen=capacity)
+    """经验回放缓冲区: 预分配定长NumPy数组的环形缓冲区，保存压缩样本(见memory.samples)
+    
+    棋盘、走棋方、稀疏策略和价值分别保存在(capacity, ...)的数组中，写满后覆盖最早的样本。
+    一次写入一局(或多局)的样本，采样时用一次花式索引取出一批，展开为可以直接交给train_network的连续数组。
+    """
+    def __init__(self, capacity, policy_slots=POLICY_SLOTS):
+        """
+        :param capacity: 最多保存的样本数，每个样本约(100 + 6 * policy_slots)字节
+        :param policy_slots: 每个样本的策略项数上限
+        """
+        self.capacity = capacity
+        self.policy_slots = policy_slots
+        self.boards = np.zeros((capacity, BOARD_ROWS * BOARD_COLS), dtype=np.int8)
+        self.players = np.zeros(capacity, dtype=np.int8)
+        # 空的策略项编号为POLICY_SIZE，展开时写到多出的一列上再丢弃
+        self.policy_indices = np.full((capacity, policy_slots), POLICY_SIZE, dtype=np.int16)
+        self.policy_probs = np.zeros((capacity, policy_slots), dtype=np.float32)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self._next = 0  # 下一个写入位置
+        self._size = 0
+        self._rng = np.random.default_rng()
     
-    def add(self, state, policy, value):
+    def add(self, board, player, policy_indices, policy_probs, value):
         """添加样本"""
-        self.buffer.append((state, policy, value))
+        self.add_game([(board, player, policy_indices, policy_probs, value)])
+    
+    def add_game(self, samples):
+        """添加一局(或多局)的压缩样本，每个数组只做一次批量写入"""
+        samples = samples[-self.capacity:]
+        count = len(samples)
+        if count == 0:
+            return
+        
+        indices = np.full((count, self.policy_slots), POLICY_SIZE, dtype=np.int16)
+        probs = np.zeros((count, self.policy_slots), dtype=np.float32)
+        sparse = [self._truncate(sample[2], sample[3]) for sample in samples]
+        lengths = np.array([len(sample_indices) for sample_indices, _ in sparse])
+        if lengths.sum():
+            # 所有样本的策略项拼接后按(行, 列)一次写入
+            rows = np.repeat(np.arange(count), lengths)
+            cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            indices[rows, cols] = np.concatenate([sample_indices for sample_indices, _ in sparse])
+            probs[rows, cols] = np.concatenate([sample_probs for _, sample_probs in sparse])
+        
+        positions = (self._next + np.arange(count)) % self.capacity
+        self.boards[positions] = np.array([sample[0] for sample in samples], dtype=np.int8).reshape(count, -1)
+        self.players[positions] = [sample[1] for sample in samples]
+        self.policy_indices[positions] = indices
+        self.policy_probs[positions] = probs
+        self.values[positions] = [sample[4] for sample in samples]
+        self._next = (self._next + count) % self.capacity
+        self._size = min(self._size + count, self.capacity)
+    
+    def _truncate(self, indices, probs):
+        """策略项超过policy_slots时保留概率最大的部分并重新归一化"""
+        if len(indices) <= self.policy_slots:
+            return indices, probs
+        keep = np.argpartition(probs, -self.policy_slots)[-self.policy_slots:]
+        probs = probs[keep]
+        total = probs.sum()
+        return indices[keep], probs / total if total > 0 else probs
     
     def sample(self, batch_size):
-        """随机采样"""
-        return random.sample(self.buffer, min(batch_size, len(self.buffer)))
+        """随机采样(不放回)
+        
+        :return: (states, policies, values)，形状分别为(N, 15, 10, 9)、(N, 2086)、(N,)的float32连续数组
+        """
+        rows = self._rng.choice(self._size, min(batch_size, self._size), replace=False)
+        states = encode_boards(self.boards[rows], self.players[rows])
+        policies = np.zeros((len(rows), POLICY_SIZE + 1), dtype=np.float32)
+        np.put_along_axis(policies, self.policy_indices[rows].astype(np.int64), self.policy_probs[rows], axis=1)
+        return states, np.ascontiguousarray(policies[:, :POLICY_SIZE]), self.values[rows]
     
     def __len__(self):
-        return len(self.buffer)
+        return self._size
@@ -0,0 +1,44 @@
+import numpy as np
+from cn_chess import BOARD_SQUARES, BOARD_ROWS, BOARD_COLS, POLICY_SIZE, encode_boards
+
+# 压缩的训练样本: (棋盘, 走棋方, 走法编号, 概率, 价值)
+# 棋盘为(90,)的int8棋子ID数组(行优先)，策略只保存合法走法上的概率，走法编号为int16、概率为float32；
+# 一个样本的数据约300字节(展开后约22KB)，训练时才用expand_samples()展开为网络输入和稠密的策略向量
+
+
+def compress_sample(game, policy, value=None):
+    """把game当前局面和策略向量压缩为一个样本
+    
+    :param game: ChineseChess，样本对应的局面
+    :param policy: (2086,)的策略向量，只保留game合法走法上的概率
+    :param value: 走棋方视角的价值，对局结束后才知道时先传None，再用with_value()填入
+    """
+    indices = game.legal_move_indices()
+    board = np.array([game.squares[sq] for sq in BOARD_SQUARES.tolist()], dtype=np.int8)
+    return board, game.current_player, indices.astype(np.int16), np.asarray(policy, dtype=np.float32)[indices], value
+
+
+def with_value(sample, value):
+    """返回填入价值后的样本"""
+    return sample[:4] + (value,)
+
+
+def expand_samples(samples):
+    """把一批压缩样本展开为训练用的连续数组
+    
+    :return: (states, policies, values)，形状分别为(N, 15, 10, 9)、(N, 2086)、(N,)的float32数组
+    """
+    count = len(samples)
+    boards = np.array([sample[0] for sample in samples], dtype=np.int8).reshape(count, BOARD_ROWS * BOARD_COLS)
+    players = np.array([sample[1] for sample in samples], dtype=np.int8)
+    states = encode_boards(boards, players)
+    
+    # 稀疏策略一次性写入稠密数组: 每个样本的走法编号按样本行号展开
+    policies = np.zeros((count, POLICY_SIZE), dtype=np.float32)
+    lengths = [len(sample[2]) for sample in samples]
+    if sum(lengths):
+        rows = np.repeat(np.arange(count), lengths)
+        policies[rows, np.concatenate([sample[2] for sample in samples])] = np.concatenate(
+            [sample[3] for sample in samples])
+    values = np.array([sample[4] for sample in samples], dtype=np.float32)
+    return states, policies, values
@@ -1,2 +1,4 @@
 # 模型模块
-from .chess_net import ChessNet
\ No newline at end of file
+from .chess_net import ChessNet
+from .inference import (InferenceModel, export_for_inference, check_accuracy, get_inference_model,
+                        weights_version)
@@ -1,12 +1,18 @@
 import torch
 import torch.nn as nn
+from cn_chess import FLIP_POLICY, FLIP_PLANES
 
 class ChessNet(nn.Module):
     """中国象棋神经网络模型"""
-    def __init__(self, input_channels=15):
+    def __init__(self, input_channels=15, canonical=False):
         super(ChessNet, self).__init__()
         # 输入通道数：7种红棋 + 7种黑棋 + 当前玩家
         self.input_channels = input_channels
+        # 为True时黑方走棋的局面先红黑互换成红方走棋再计算，策略输出换回原局面的走法编号，
+        # 网络只需学习走棋方一个视角；输入输出格式不变
+        self.canonical = canonical
+        self.register_buffer('flip_policy', torch.as_tensor(FLIP_POLICY), persistent=False)
+        self.register_buffer('flip_planes', torch.as_tensor(FLIP_PLANES), persistent=False)
         
         # 共享特征提取层
         self.common_layers = nn.Sequential(
@@ -22,14 +28,13 @@ class ChessNet(nn.Module):
         )
         
         # 策略头 - 输出动作概率
-        # 中国象棋最大可能的动作数为：约90个棋子位置 * 90个目标位置 = 8100
-        # 但实际上可能的移动远少于此，我们使用(10*9)*(10*9)=8100作为上限
+        # 输出维度为所有几何上可能的走法数2086，第i个输出对应cn_chess.INDEX_TO_MOVE[i]
         self.policy_head = nn.Sequential(
             nn.Conv2d(128, 32, kernel_size=1),
             nn.BatchNorm2d(32),
             nn.ReLU(),
             nn.Flatten(),
-            nn.Linear(32 * 10 * 9, 2086)  # 更准确的动作空间大小估计
+            nn.Linear(32 * 10 * 9, 2086)  # cn_chess.POLICY_SIZE
         )
         
         # 价值头 - 估计当前局面价值
@@ -46,7 +51,15 @@ class ChessNet(nn.Module):
     
     def forward(self, x):
         """前向传播"""
+        if self.canonical:
+            # 当前玩家平面为0的局面(黑方走棋)红黑互换: 平面反序、棋盘旋转180度、当前玩家平面取反
+            black = x[:, -1, 0, 0] < 0.5
+            flipped = x[:, self.flip_planes].flip(2, 3)
+            flipped[:, -1] = 1 - flipped[:, -1]
+            x = torch.where(black.view(-1, 1, 1, 1), flipped, x)
         common_features = self.common_layers(x)
         policy_logits = self.policy_head(common_features)
         value = self.value_head(common_features)
+        if self.canonical:
+            policy_logits = torch.where(black.view(-1, 1), policy_logits[:, self.flip_policy], policy_logits)
         return policy_logits, value
@@ -0,0 +1,143 @@
+import copy
+import itertools
+import random
+import weakref
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+# 导出方式: 'fp32'为折叠BN + channels_last + TorchScript；'int8'在此基础上把全连接层动态量化为int8
+INFERENCE_MODES = ('fp32', 'int8')
+# 精度检查的容差: 策略概率和价值与原模型的最大绝对误差
+DEFAULT_TOLERANCE = {'fp32': 1e-4, 'int8': 5e-2}
+
+
+def weights_version(model):
+    """模型权重的版本: 参数和缓冲区原地修改计数之和，optimizer.step()、load_state_dict()等修改权重的操作都会使其变化
+    
+    EvaluationCache和get_inference_model()都用它判断权重是否更新
+    """
+    return sum(tensor._version for tensor in itertools.chain(model.parameters(), model.buffers()))
+
+
+class InferenceModel(nn.Module):
+    """导出后只用于推理的模型，输入输出与ChessNet相同"""
+    
+    def __init__(self, module, mode):
+        super().__init__()
+        self.module = module
+        self.mode = mode
+        self.accuracy = None  # check_accuracy()的结果
+    
+    def forward(self, x):
+        return self.module(x.contiguous(memory_format=torch.channels_last))
+
+
+def fold_batch_norm(model):
+    """返回模型的推理副本: 每个紧跟在卷积层后面的BatchNorm2d折叠进卷积的权重和偏置，BN换成Identity"""
+    model = copy.deepcopy(model).cpu().eval()
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for index in range(len(module) - 1):
+            conv, bn = module[index], module[index + 1]
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                module[index] = fuse_conv_bn_eval(conv, bn)
+                module[index + 1] = nn.Identity()
+    return model
+
+
+def export_for_inference(model, mode='fp32', check=True, tolerance=None):
+    """导出CPU推理用的模型
+    
+    依次折叠BN、转为channels_last布局、用TorchScript跟踪并冻结；mode为'int8'时先对全连接层做
+    动态量化(策略头的全连接层占了绝大部分参数)。
+    
+    :param model: ChessNet，导出不影响原模型
+    :param mode: 'fp32'或'int8'
+    :param check: 是否用随机对局中的局面比较导出模型与原模型的输出
+    :param tolerance: 策略概率和价值允许的最大绝对误差，默认按mode取DEFAULT_TOLERANCE
+    :return: InferenceModel，检查结果在accuracy属性中；误差超过容差时抛出ValueError
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"未知的导出方式: {mode}")
+    fused = fold_batch_norm(model).to(memory_format=torch.channels_last)
+    if mode == 'int8':
+        fused = torch.ao.quantization.quantize_dynamic(fused, {nn.Linear}, dtype=torch.qint8)
+    
+    example = torch.zeros((2, model.input_channels, 10, 9)).contiguous(memory_format=torch.channels_last)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(fused, example))
+    exported = InferenceModel(scripted, mode)
+    
+    if check:
+        exported.accuracy = check_accuracy(model, exported)
+        limit = DEFAULT_TOLERANCE[mode] if tolerance is None else tolerance
+        if max(exported.accuracy['policy_error'], exported.accuracy['value_error']) > limit:
+            raise ValueError(f"导出模型({mode})与原模型的误差超过{limit}: {exported.accuracy}")
+    return exported
+
+
+def sample_states(num_positions=64, seed=0):
+    """从随机对局中取局面，作为精度检查的输入"""
+    from cn_chess import ChineseChess
+    rng = random.Random(seed)
+    states = []
+    while len(states) < num_positions:
+        game = ChineseChess()
+        for _ in range(rng.randrange(0, 80)):
+            if game.is_game_over():
+                break
+            game.push(rng.choice(game.get_legal_actions()))
+        states.append(game.get_state())
+    return np.array(states, dtype=np.float32)
+
+
+def check_accuracy(model, exported, states=None):
+    """比较导出模型与原模型(推理模式)在同一批局面上的输出
+    
+    :param states: (N, 15, 10, 9)的状态数组，默认用sample_states()
+    :return: 字典，策略概率和价值的最大绝对误差、策略的平均KL散度、最大概率走法一致的比例
+    """
+    if states is None:
+        states = sample_states()
+    inputs = torch.from_numpy(np.ascontiguousarray(states, dtype=np.float32))
+    reference = copy.deepcopy(model).cpu().eval()
+    with torch.no_grad():
+        ref_logits, ref_values = reference(inputs)
+        logits, values = exported(inputs)
+    ref_log_policy = torch.log_softmax(ref_logits, dim=1)
+    log_policy = torch.log_softmax(logits, dim=1)
+    return {
+        'policy_error': (ref_log_policy.exp() - log_policy.exp()).abs().max().item(),
+        'value_error': (ref_values - values).abs().max().item(),
+        'policy_kl': (ref_log_policy.exp() * (ref_log_policy - log_policy)).sum(dim=1).mean().item(),
+        'top1_agreement': (ref_logits.argmax(dim=1) == logits.argmax(dim=1)).float().mean().item(),
+    }
+
+
+# 原模型 -> {导出方式: (导出时的权重版本, 导出模型)}
+_exported_models = weakref.WeakKeyDictionary()
+
+
+def get_inference_model(model, mode):
+    """返回model的导出模型，权重不变时复用上次的导出结果，权重更新后重新导出
+    
+    mode为None时直接返回model；int8导出的精度检查不通过时打印提示并改用fp32导出
+    """
+    if mode is None or isinstance(model, InferenceModel):
+        return model
+    version = weights_version(model)
+    exported = _exported_models.setdefault(model, {})
+    if mode in exported and exported[mode][0] == version:
+        return exported[mode][1]
+    try:
+        inference_model = export_for_inference(model, mode)
+    except ValueError as error:
+        if mode != 'int8':
+            raise
+        print(f"int8量化精度不足，改用fp32导出: {error}")
+        inference_model = export_for_inference(model, 'fp32')
+    exported[mode] = (version, inference_model)
+    return inference_model
@@ -0,0 +1,124 @@
+import argparse
+import sys
+import time
+from cn_chess import ChineseChess
+
+# 测试局面: 名称 -> (FEN, {深度: 叶节点数})
+# 除开局局面外，参考值由原来基于Piece对象、逐步试走的实现独立算出
+PERFT_POSITIONS = {
+    # 开局局面，参考值与公开的象棋perft结果一致
+    'start': (
+        'rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1',
+        {1: 44, 2: 1920, 3: 79666, 4: 3290240},
+    ),
+    # 将帅之间的炮架: 双方的炮隔着两个炮架对着将/帅
+    'cannon_screens': (
+        'r2ak4/4a4/4c4/9/2b1P4/9/4C1n2/2N1C4/4A4/3AK3R w - - 0 1',
+        {1: 36, 2: 1127, 3: 42834, 4: 1277377},
+    ),
+    # 马脚: 多个马被己方或对方棋子绊住
+    'horse_legs': (
+        '3akab2/9/2n1b1n2/2p1N1p2/3P1P3/2N3n2/3p5/4B4/4A4/3AK4 w - - 0 1',
+        {1: 27, 2: 780, 3: 17473, 4: 452309},
+    ),
+    # 将帅对面: 黑车挡在对面的两将之间并将军
+    'flying_general': (
+        '3k5/9/9/9/3r5/9/9/4A4/9/3K5 w - - 0 1',
+        {1: 2, 2: 35, 3: 78, 4: 1347},
+    ),
+    # 过河兵: 双方的兵/卒已经过河，可以横走
+    'river_pawns': (
+        '4k4/9/3P1P3/9/2p3P2/2P3p2/9/3p1p3/4A4/4K4 w - - 0 1',
+        {1: 12, 2: 149, 3: 1981, 4: 21659},
+    ),
+    # 吃掉将军的棋子: 黑车将军，红马可以吃车解将，帅也可以左右避开
+    'capture_checker': (
+        '3k5/9/9/9/4r4/9/3N5/9/9/4K4 w - - 0 1',
+        {1: 4, 2: 58, 3: 277, 4: 4599},
+    ),
+    # 帅和仕都能吃掉贴身将军的卒
+    'king_captures_checker': (
+        '3k5/9/9/9/9/9/9/9/4p4/3AK4 w - - 0 1',
+        {1: 3, 2: 8, 3: 19, 4: 52},
+    ),
+}
+
+
+def perft(game, depth, verify=False):
+    """统计从当前局面出发走depth步后的叶节点数"""
+    if verify:
+        verify_position(game)
+    legal_actions = game.get_legal_actions()
+    if depth == 1 and not verify:
+        return len(legal_actions)
+
+    nodes = 0
+    for action in legal_actions:
+        game.push(action)
+        nodes += 1 if depth == 1 else perft(game, depth - 1, verify)
+        game.pop()
+    return nodes
+
+
+def verify_position(game):
+    """对当前局面做差分校验: 快速的将军检测、合法走法生成与参考实现必须一致"""
+    for player in (1, -1):
+        if game._is_checked(player) != game._is_checked_by_moves(player):
+            raise AssertionError(f"将军检测不一致: player={player}\n{game.board}")
+        fast = sorted(game._legal_moves(player))
+        slow = sorted(game._legal_moves_by_trial(player))
+        if fast != slow:
+            raise AssertionError(f"合法走法不一致: player={player}, 差异={set(fast) ^ set(slow)}\n{game.board}")
+
+
+def divide(game, depth):
+    """按根节点的每个走法分别统计叶节点数，便于定位出错的走法"""
+    for action in game.get_legal_actions():
+        game.push(action)
+        nodes = 1 if depth == 1 else perft(game, depth - 1)
+        game.pop()
+        print(f"{action}: {nodes}")
+
+
+def main(args):
+    names = list(PERFT_POSITIONS) if args.position == 'all' else [args.position]
+    failed = False
+
+    for name in names:
+        fen, expected = PERFT_POSITIONS[name]
+        game = ChineseChess.from_fen(fen)
+
+        if args.divide:
+            divide(game, args.depth)
+            continue
+
+        for depth in range(1, args.depth + 1):
+            start = time.perf_counter()
+            nodes = perft(game, depth, verify=args.verify)
+            elapsed = time.perf_counter() - start
+
+            reference = expected.get(depth)
+            if reference is None:
+                status = "无参考值"
+            elif reference == nodes:
+                status = "正确"
+            else:
+                status = f"错误(参考值 {reference})"
+                failed = True
+            print(f"{name:<16} depth={depth} nodes={nodes:<10} time={elapsed:.3f}s "
+                  f"nps={nodes / max(elapsed, 1e-9):,.0f} {status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="中国象棋走法生成perft测试")
+    parser.add_argument("--position", type=str, default="all", choices=["all"] + list(PERFT_POSITIONS),
+                        help="测试局面")
+    parser.add_argument("--depth", type=int, default=3, help="最大搜索深度")
+    parser.add_argument("--verify", action="store_true",
+                        help="在每个节点把将军检测和合法走法与参考实现做差分校验(很慢)")
+    parser.add_argument("--divide", action="store_true", help="按根节点走法分别输出叶节点数")
+
+    args = parser.parse_args()
+    sys.exit(main(args))
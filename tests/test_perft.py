@@ -0,0 +1,37 @@
+import pytest
+from cn_chess import ChineseChess, POS_TO_SQUARE
+from perft import PERFT_POSITIONS, perft
+
+# 逐节点差分校验很慢，只校验到较浅的深度
+VERIFY_DEPTH = 2
+MAX_DEPTH = 3
+
+
+@pytest.mark.parametrize('name', list(PERFT_POSITIONS))
+def test_perft_counts(name):
+    fen, expected = PERFT_POSITIONS[name]
+    game = ChineseChess.from_fen(fen)
+    for depth in range(1, MAX_DEPTH + 1):
+        assert perft(game, depth) == expected[depth], f"{name} depth={depth}"
+
+
+@pytest.mark.parametrize('name', list(PERFT_POSITIONS))
+def test_perft_matches_reference_generator(name):
+    fen, expected = PERFT_POSITIONS[name]
+    game = ChineseChess.from_fen(fen)
+    # verify=True时每个节点的将军检测和合法走法都与逐步试走的参考实现比较
+    assert perft(game, VERIFY_DEPTH, verify=True) == expected[VERIFY_DEPTH]
+
+
+@pytest.mark.parametrize('name, capture', [
+    ('capture_checker', ((6, 3), (4, 4))),
+    ('king_captures_checker', ((9, 4), (8, 4))),
+    ('king_captures_checker', ((9, 3), (8, 4))),
+])
+def test_capture_checking_piece(name, capture):
+    game = ChineseChess.from_fen(PERFT_POSITIONS[name][0])
+    assert game._is_checked(game.current_player)
+    assert capture in game.get_legal_actions()
+    game.push(capture)
+    assert game.squares[POS_TO_SQUARE[capture[1]]] > 0
+    assert not game._is_checked(-game.current_player)
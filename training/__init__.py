@@ -1,3 +1,5 @@
 # 训练模块
 from .trainer import train_network
 from .self_play import self_play
+from .augmentation import mirror_samples
+from .parallel_self_play import SelfPlayPool, publish_checkpoint
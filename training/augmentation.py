@@ -0,0 +1,13 @@
+from cn_chess import BOARD_ROWS, BOARD_COLS, MIRROR_POLICY
+
+
+def mirror_samples(training_data):
+    """返回训练样本左右镜像后的副本，与self_play()的压缩样本格式相同
+    
+    象棋规则左右对称，镜像局面的价值不变，棋盘每行左右翻转，走法编号按cn_chess.MIRROR_POLICY置换
+    """
+    return [
+        (board.reshape(BOARD_ROWS, BOARD_COLS)[:, ::-1].reshape(-1), player,
+         MIRROR_POLICY[indices].astype(indices.dtype), probs, value)
+        for board, player, indices, probs, value in training_data
+    ]
@@ -0,0 +1,270 @@
+import os
+import queue
+import time
+import traceback
+import torch
+import torch.multiprocessing as mp
+from cn_chess import STATE_PLANES, BOARD_ROWS, BOARD_COLS, POLICY_SIZE
+from mcts.eval_cache import EvaluationCache
+from models.inference import get_inference_model
+from .self_play import self_play
+
+
+def publish_checkpoint(model, path):
+    """保存模型权重供推理进程热加载: 先写临时文件再原子替换，推理进程不会读到写了一半的文件"""
+    tmp_path = path + '.tmp'
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, path)
+
+
+class InferenceClient:
+    """自我对弈进程中代替ChessNet的对象: 调用时把状态写入共享内存，请求推理进程计算后读回结果
+    
+    只实现self_play和mcts_search用到的接口(前向计算、eval，以及EvaluationCache.model_key用到的parameters/buffers)
+    """
+    
+    def __init__(self, worker_id, buffers, requests, responses, generation):
+        self.worker_id = worker_id
+        self.states, self.logits, self.values = buffers
+        self.requests = requests
+        self.responses = responses
+        self.generation = generation
+        self._seen_generation = generation.value
+        # 推理进程每加载一次新权重就原地修改一次，EvaluationCache.model_key在每次搜索开始时
+        # 据此发现权重变化并清除旧权重的缓存项
+        self._weights_version = torch.zeros(1)
+    
+    def __call__(self, state_tensor):
+        count = len(state_tensor)
+        self.states[self.worker_id, :count].copy_(state_tensor)
+        self.requests.put((self.worker_id, count))
+        error = self.responses.get()
+        if error is not None:
+            raise RuntimeError(f"推理进程出错:\n{error}")
+        return self.logits[self.worker_id, :count].clone(), self.values[self.worker_id, :count].clone()
+    
+    def eval(self):
+        """推理进程中的模型始终处于推理模式"""
+        return self
+    
+    def parameters(self):
+        return iter(())
+    
+    def buffers(self):
+        generation = self.generation.value
+        if generation != self._seen_generation:
+            self._seen_generation = generation
+            self._weights_version.add_(1)
+        return iter((self._weights_version,))
+
+
+def _load_checkpoint(model, path, device):
+    """加载权重，成功时返回文件的修改时间，文件不存在或损坏时返回None"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        model.load_state_dict(torch.load(path, map_location=device))
+        return mtime
+    except (OSError, RuntimeError, EOFError):
+        return None
+
+
+def _inference_main(model_kwargs, checkpoint_path, device, buffers, requests, responses, generation, stop,
+                    reload, max_batch_size, max_wait, reload_interval, inference):
+    """推理进程: 合并所有自我对弈进程的请求，凑够max_batch_size个局面或等待超过max_wait秒后一起计算"""
+    from models.chess_net import ChessNet
+    if inference is not None:
+        device = 'cpu'
+    states, logits, values = buffers
+    model = ChessNet(**model_kwargs).to(device)
+    model.eval()
+    loaded_mtime = _load_checkpoint(model, checkpoint_path, device)
+    next_reload_check = time.perf_counter() + reload_interval
+    
+    while not stop.is_set():
+        # 定期检查检查点文件，有新权重时热加载并通知自我对弈进程清空评估缓存；
+        # reload被设置时(SelfPlayPool.update())立即重新加载
+        now = time.perf_counter()
+        forced = reload.is_set()
+        if forced or now >= next_reload_check:
+            next_reload_check = now + reload_interval
+            reload.clear()
+            try:
+                mtime = os.stat(checkpoint_path).st_mtime_ns
+            except OSError:
+                mtime = loaded_mtime
+            if forced or mtime != loaded_mtime:
+                mtime = _load_checkpoint(model, checkpoint_path, device)
+                if mtime is not None:
+                    loaded_mtime = mtime
+                    with generation.get_lock():
+                        generation.value += 1
+        
+        try:
+            batch = [requests.get(timeout=0.1)]
+        except queue.Empty:
+            continue
+        total = batch[0][1]
+        deadline = time.perf_counter() + max_wait
+        while total < max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            total += request[1]
+        
+        try:
+            state_tensor = torch.cat([states[worker_id, :count] for worker_id, count in batch]).to(device)
+            with torch.no_grad():
+                # 导出的推理模型按权重版本缓存，热加载新权重后自动重新导出
+                policy_logits, value_tensor = get_inference_model(model, inference)(state_tensor)
+            policy_logits = policy_logits.cpu()
+            value_tensor = value_tensor.view(-1).cpu()
+            offset = 0
+            for worker_id, count in batch:
+                logits[worker_id, :count] = policy_logits[offset:offset + count]
+                values[worker_id, :count] = value_tensor[offset:offset + count]
+                offset += count
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        for worker_id, _ in batch:
+            responses[worker_id].put(error)
+
+
+def _worker_main(worker_id, buffers, requests, response, tasks, results, generation, options):
+    """自我对弈进程: 每次从任务队列取一局(对手类型)，对弈完把训练数据放入结果队列"""
+    torch.set_num_threads(1)
+    # 推理进程换了权重后，client的版本随之变化，下一次搜索开始时旧的评估结果作废
+    client = InferenceClient(worker_id, buffers, requests, response, generation)
+    cache = EvaluationCache(options['cache_size'], symmetric=options['symmetric_cache'])
+    while True:
+        opponent = tasks.get()
+        if opponent is None:
+            return
+        try:
+            training_data = self_play(client, 'cpu', num_games=1, mcts_simulations=options['mcts_simulations'],
+                                      opponent=opponent, mcts_batch_size=options['mcts_batch_size'], cache=cache,
+                                      mcts_threads=options['mcts_threads'], root_policy=options['root_policy'],
+                                      mirror_augment=options['mirror_augment'])
+            results.put((worker_id, training_data))
+        except Exception:
+            results.put((worker_id, traceback.format_exc()))
+
+
+class SelfPlayPool:
+    """多进程自我对弈: num_workers个进程同时对弈，神经网络计算集中在一个推理进程中批量完成
+    
+    自我对弈进程与推理进程之间通过共享内存交换状态和网络输出，队列中只传递(进程编号, 局面数)。
+    推理进程定期检查checkpoint_path，文件更新后热加载新权重，进程不需要重启；
+    训练后调用update(model)发布新权重即可。所有进程用spawn方式启动，调用方的主模块需要
+    放在 if __name__ == "__main__": 之下。
+    """
+    
+    def __init__(self, model, checkpoint_path, num_workers=None, device='cpu', mcts_simulations=100,
+                 mcts_batch_size=1, mcts_threads=1, root_policy='puct', max_batch_size=None, max_wait=0.005,
+                 reload_interval=1.0, cache_size=200000, inference=None, symmetric_cache=False,
+                 mirror_augment=False):
+        """
+        :param model: 初始模型，权重写入checkpoint_path后由推理进程加载
+        :param checkpoint_path: 推理进程监视的检查点文件
+        :param num_workers: 自我对弈进程数，默认为CPU核数减1
+        :param device: 推理进程使用的设备
+        :param max_batch_size: 推理进程一次计算的最大局面数，默认为所有进程同时请求的最大局面数
+        :param max_wait: 凑批时最多等待的秒数
+        :param reload_interval: 检查检查点文件是否更新的间隔(秒)
+        :param cache_size: 每个自我对弈进程的评估缓存大小，权重更新后清空
+        :param inference: 推理进程的网络推理方式，None、'fp32'或'int8'(见mcts_search)，不为None时在CPU上计算
+        :param symmetric_cache: 评估缓存中对称的局面是否共用缓存项，见EvaluationCache
+        其余参数与self_play相同
+        """
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.checkpoint_path = checkpoint_path
+        publish_checkpoint(model, checkpoint_path)
+        
+        # 每个自我对弈进程一次最多请求的局面数
+        slot_size = max(mcts_batch_size, mcts_threads)
+        # 队列和共享内存由本对象持有，子进程启动后仍然有效
+        self._buffers = buffers = (
+            torch.zeros((self.num_workers, slot_size, STATE_PLANES, BOARD_ROWS, BOARD_COLS)).share_memory_(),
+            torch.zeros((self.num_workers, slot_size, POLICY_SIZE)).share_memory_(),
+            torch.zeros((self.num_workers, slot_size)).share_memory_(),
+        )
+        ctx = mp.get_context('spawn')
+        self._requests = requests = ctx.Queue()
+        self._responses = responses = [ctx.SimpleQueue() for _ in range(self.num_workers)]
+        self.generation = ctx.Value('i', 0)  # 推理进程加载权重的次数
+        self._stop = ctx.Event()
+        self._reload = ctx.Event()
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        
+        self._server = ctx.Process(
+            target=_inference_main,
+            args=({'input_channels': model.input_channels, 'canonical': model.canonical}, checkpoint_path, str(device), buffers, requests,
+                  responses, self.generation, self._stop, self._reload, max_batch_size or self.num_workers * slot_size,
+                  max_wait, reload_interval, inference),
+            daemon=True)
+        self._server.start()
+        
+        options = {'mcts_simulations': mcts_simulations, 'mcts_batch_size': mcts_batch_size,
+                   'mcts_threads': mcts_threads, 'root_policy': root_policy, 'cache_size': cache_size,
+                   'symmetric_cache': symmetric_cache, 'mirror_augment': mirror_augment}
+        self._workers = [
+            ctx.Process(target=_worker_main,
+                        args=(worker_id, buffers, requests, responses[worker_id], self._tasks, self._results,
+                              self.generation, options),
+                        daemon=True)
+            for worker_id in range(self.num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+    
+    def play(self, num_games, opponent='self'):
+        """分给各进程对弈num_games局，返回与self_play相同格式的训练数据
+        
+        :param opponent: 'self'或'random'
+        """
+        for _ in range(num_games):
+            self._tasks.put(opponent)
+        training_data = []
+        for _ in range(num_games):
+            worker_id, result = self._results.get()
+            if isinstance(result, str):
+                raise RuntimeError(f"自我对弈进程{worker_id}出错:\n{result}")
+            training_data.extend(result)
+        return training_data
+    
+    def update(self, model, timeout=60.0):
+        """发布新权重，等推理进程加载完成后返回，之后开始的对局都使用新权重
+        
+        :param timeout: 最多等待的秒数，超时或推理进程已退出时抛出RuntimeError
+        """
+        generation = self.generation.value
+        publish_checkpoint(model, self.checkpoint_path)
+        self._reload.set()
+        deadline = time.perf_counter() + timeout
+        while self.generation.value == generation:
+            if not self._server.is_alive():
+                raise RuntimeError("推理进程已退出，无法加载新权重")
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"推理进程在{timeout}秒内没有加载新权重")
+            time.sleep(0.005)
+    
+    def close(self):
+        """结束所有进程"""
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._stop.set()
+        self._server.join()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
@@ -2,11 +2,16 @@ import torch
 import numpy as np
 import random
 import copy
-from cn_chess import ChineseChess
-from mcts.mcts import mcts_search
+from cn_chess import ChineseChess, POLICY_SIZE
+from mcts.mcts import mcts_search, promote_roots
+from mcts.eval_cache import EvaluationCache
 from mcts.mcts_node import MCTSNode  # 添加MCTSNode的导入
+from memory.samples import compress_sample, with_value
+from .augmentation import mirror_samples
 
-def self_play(model, device, num_games=10, mcts_simulations=100, opponent='self', opponent_model=None):
+def self_play(model, device, num_games=10, mcts_simulations=100, opponent='self', opponent_model=None,
+              mcts_batch_size=1, reuse_tree=True, cache=None, mcts_threads=1, root_policy='puct',
+              inference=None, mirror_augment=False):
     """自我对弈或与其他对手对弈收集训练数据
     
     参数:
@@ -16,20 +21,35 @@ def self_play(model, device, num_games=10, mcts_simulations=100, opponent='self'
         mcts_simulations: MCTS模拟次数
         opponent: 对手类型 ('self', 'random', 'model')
         opponent_model: 对手模型 (如果对手类型为'model')
+        mcts_batch_size: MCTS每轮批量评估的叶节点数
+        reuse_tree: 走子后保留所选走法的子树，作为下一次搜索的根节点
+        cache: 神经网络评估缓存(EvaluationCache)，为None时为本次调用新建一个，各局之间共享
+        mcts_threads: 大于1时使用多线程树并行搜索
+        root_policy: 根节点的选择方式，'puct'或'gumbel'(Gumbel top-k + 逐次减半，模拟次数少时策略目标更好)
+        inference: 网络推理方式，None、'fp32'或'int8'，见mcts_search
+        mirror_augment: 为True时每个样本再加入左右镜像的副本，每局得到两倍的训练数据
+    
+    返回:
+        压缩样本(棋盘, 走棋方, 走法编号, 概率, 价值)的列表，见memory.samples，训练时用expand_samples()展开
     """
+    # 推理模式: BatchNorm使用训练得到的统计量，前向计算不修改缓冲区，评估缓存的模型版本保持不变
+    model.eval()
+    if opponent_model is not None:
+        opponent_model.eval()
     training_data = []
+    if cache is None:
+        cache = EvaluationCache()
     
     for game_idx in range(num_games):
         game = ChineseChess()
-        game_memory = []
+        game_memory = []  # 压缩的样本(见memory.samples)，对局结束后填入价值
+        search_roots = {}  # 每个模型的搜索树，键为模型
         
         # 如果对手是自己，使用相同模型
         if opponent == 'self':
             opponent_model = model
         
         while not game.is_game_over():
-            state = game.get_state()
-            
             # 确定当前移动的模型
             if game.current_player == 1 or opponent == 'self':
                 current_model = model
@@ -40,30 +60,35 @@ def self_play(model, device, num_games=10, mcts_simulations=100, opponent='self'
                 legal_actions = game.get_legal_actions()
                 action = random.choice(legal_actions)
                 # 构建一个全零策略，只在选择的动作处为1
-                full_policy = np.zeros(2086)
-                idx = MCTSNode.move_to_index(action)
-                if idx < len(full_policy):
-                    full_policy[idx] = 1.0
+                full_policy = np.zeros(POLICY_SIZE)
+                full_policy[MCTSNode.move_to_index(action)] = 1.0
                 
                 # 记录状态和策略
-                game_memory.append((state, full_policy, None))
+                game_memory.append(compress_sample(game, full_policy))
                 
                 # 执行动作
                 game.make_move(action[0], action[1])
+                search_roots = promote_roots(search_roots, action)
                 continue
             
             # 使用MCTS搜索最佳动作
-            actions, action_probs, full_policy = mcts_search(game, current_model, device, num_simulations=mcts_simulations)
+            actions, action_probs, full_policy, root = mcts_search(
+                game, current_model, device, num_simulations=mcts_simulations, batch_size=mcts_batch_size,
+                root=search_roots.get(current_model), return_root=True, cache=cache, num_threads=mcts_threads,
+                root_policy=root_policy, inference=inference)
+            if reuse_tree:
+                search_roots[current_model] = root
             
             # 根据概率选择动作
             action_idx = np.random.choice(len(actions), p=action_probs)
             action = actions[action_idx]
             
             # 记录当前状态和动作概率
-            game_memory.append((state, full_policy, None))
+            game_memory.append(compress_sample(game, full_policy))
             
             # 执行动作
             game.make_move(action[0], action[1])
+            search_roots = promote_roots(search_roots, action)
         
         # 游戏结束，填充价值标签
         winner = game.get_winner()
@@ -74,13 +99,15 @@ def self_play(model, device, num_games=10, mcts_simulations=100, opponent='self'
             value = -1
         
         # 更新所有游戏状态的价值
-        for i in range(len(game_memory)):
-            state, policy_vector, _ = game_memory[i]
-            # 根据当前玩家调整价值
-            player = 1 if i % 2 == 0 else -1
-            adjusted_value = value * player
+        game_data = []
+        for sample in game_memory:
+            # 根据样本局面的走棋方调整价值
+            adjusted_value = value * sample[1]
             # 添加到训练数据
-            training_data.append((state, policy_vector, adjusted_value))
+            game_data.append(with_value(sample, adjusted_value))
+        training_data.extend(game_data)
+        if mirror_augment:
+            training_data.extend(mirror_samples(game_data))
         
         print(f"游戏 {game_idx+1}/{num_games} 完成, 胜者: {'红方' if winner == 1 else '黑方' if winner == -1 else '和棋'}")
     
@@ -1,28 +1,38 @@
 import torch
 import torch.nn as nn
 import numpy as np
-import random
+from memory.samples import expand_samples
 
 def train_network(model, optimizer, training_data, device, epochs=10, batch_size=128):
-    """训练神经网络"""
+    """训练神经网络
+    
+    :param training_data: ReplayBuffer.sample()返回的(states, policies, values)数组，直接按下标取批次；
+                          或压缩样本的列表(见memory.samples)，每个批次用到时才展开为稠密数组
+    """
+    model.train()
     criterion_policy = nn.CrossEntropyLoss()
     criterion_value = nn.MSELoss()
+    is_arrays = not isinstance(training_data, list)
+    count = len(training_data[0]) if is_arrays else len(training_data)
     
     for epoch in range(epochs):
         # 打乱数据
-        random.shuffle(training_data)
+        order = np.random.permutation(count)
         total_loss = 0
         policy_losses = 0
         value_losses = 0
         
-        for i in range(0, len(training_data), batch_size):
-            batch = training_data[i:i+batch_size]
-            states, policy_targets, value_targets = zip(*batch)
+        for i in range(0, count, batch_size):
+            batch = order[i:i+batch_size]
+            if is_arrays:
+                states, policy_targets, value_targets = (array[batch] for array in training_data)
+            else:
+                states, policy_targets, value_targets = expand_samples([training_data[j] for j in batch])
             
             # 转换为张量并移至设备
-            states = torch.FloatTensor(np.array(states)).to(device)
-            policy_targets = torch.FloatTensor(np.array(policy_targets)).to(device)
-            value_targets = torch.FloatTensor(np.array(value_targets)).unsqueeze(1).to(device)
+            states = torch.from_numpy(states).to(device)
+            policy_targets = torch.from_numpy(policy_targets).to(device)
+            value_targets = torch.from_numpy(value_targets).unsqueeze(1).to(device)
             
             # 前向传播
             policy_logits, values = model(states)
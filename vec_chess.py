@@ -0,0 +1,140 @@
+import numpy as np
+from cn_chess import (ChineseChess, BOARD_SQUARES, PADDED_SIZE, ZOBRIST_PIECE_KEYS, ZOBRIST_BLACK_TO_MOVE,
+                      REPETITION_LIMIT, POLICY_SIZE, POLICY_FROM_SQUARE, POLICY_TO_SQUARE, encode_boards,
+                      move_indices, repetition_winner)
+
+# 动作编号即策略向量的走法编号(0-2085)，与ChineseChess.legal_mask()和MCTSNode.move_to_index一致
+ACTION_SIZE = POLICY_SIZE
+ACTION_FROM_SQUARE = POLICY_FROM_SQUARE
+ACTION_TO_SQUARE = POLICY_TO_SQUARE
+
+# numpy形式的Zobrist随机数表，ZOBRIST_TABLE[piece_id + 7, square]
+ZOBRIST_TABLE = np.array(ZOBRIST_PIECE_KEYS, dtype=np.uint64)
+
+
+class VecChineseChess:
+    """N局中国象棋的批量环境，用于同步推进大量对局
+
+    所有对局的棋盘、走棋方、哈希等状态保存在堆叠的NumPy数组中，走子和状态编码
+    是对整批对局的向量化操作。合法走法复用cn_chess中的规则: 一个共享的ChineseChess
+    实例逐局载入棋盘后生成，不会为每局创建棋局对象。
+    """
+
+    def __init__(self, num_games):
+        """
+        :param num_games: 同时进行的对局数
+        """
+        self.num_games = num_games
+
+        # 每局的一维填充棋盘，与ChineseChess.squares布局相同
+        self.squares = np.zeros((num_games, PADDED_SIZE), dtype=np.int8)
+        self.players = np.ones(num_games, dtype=np.int8)  # 走棋方
+        self.zobrist_keys = np.zeros(num_games, dtype=np.uint64)
+        self.total_moves = np.zeros(num_games, dtype=np.int32)
+        self.done = np.zeros(num_games, dtype=bool)
+        self.winners = np.zeros(num_games, dtype=np.int8)  # 1/-1为胜方，0为和棋或未结束
+
+        # 每局的历史局面哈希、是否被将军和局面出现次数，用于判定重复局面和长将
+        self._history = [None] * num_games
+        self._check_history = [None] * num_games
+        self._repetitions = [None] * num_games
+        # 每局当前走棋方的合法动作掩码，已结束的对局全为False
+        self._legal_mask = np.zeros((num_games, ACTION_SIZE), dtype=bool)
+
+        # 规则引擎和开局局面
+        self._engine = ChineseChess()
+        self._initial_squares = np.array(self._engine.squares, dtype=np.int8)
+        self._initial_key = np.uint64(self._engine.zobrist_key)
+        self._initial_legal_mask = self._engine.legal_mask()
+
+        self.reset()
+
+    def reset(self, indices=None):
+        """把指定的对局(默认全部)重置为开局局面"""
+        indices = np.arange(self.num_games) if indices is None else np.asarray(indices)
+        self.squares[indices] = self._initial_squares
+        self.players[indices] = 1
+        self.zobrist_keys[indices] = self._initial_key
+        self.total_moves[indices] = 0
+        self.done[indices] = False
+        self.winners[indices] = 0
+        self._legal_mask[indices] = self._initial_legal_mask
+
+        key = int(self._initial_key)
+        for i in indices.tolist():
+            self._history[i] = [key]
+            self._check_history[i] = [False]
+            self._repetitions[i] = {key: 1}
+
+    def get_state(self, out=None):
+        """批量返回所有对局的状态，(N, 15, 10, 9)的float32连续数组，与ChineseChess.get_state()一致"""
+        return encode_boards(self.squares[:, BOARD_SQUARES], self.players, out)
+
+    def legal_mask(self):
+        """批量返回合法动作掩码，(N, 2086)的bool数组，已结束的对局全为False"""
+        return self._legal_mask.copy()
+
+    def step(self, actions):
+        """所有未结束的对局同时走一步
+
+        :param actions: (N,)的动作编号数组，已结束的对局或动作为负数的对局不走子
+        :return: (done, winners)，两个(N,)数组
+        """
+        actions = np.asarray(actions)
+        active = np.flatnonzero(~self.done & (actions >= 0))
+        if len(active) == 0:
+            return self.done, self.winners
+
+        illegal = ~self._legal_mask[active, actions[active]]
+        if illegal.any():
+            i = active[np.argmax(illegal)]
+            raise ValueError(f"对局{i}的动作{actions[i]}不合法")
+        from_sq = ACTION_FROM_SQUARE[actions[active]]
+        to_sq = ACTION_TO_SQUARE[actions[active]]
+
+        # 向量化执行走子并增量更新哈希
+        pieces = self.squares[active, from_sq]
+        captured = self.squares[active, to_sq]
+        self.squares[active, to_sq] = pieces
+        self.squares[active, from_sq] = 0
+        self.zobrist_keys[active] ^= (ZOBRIST_TABLE[pieces + 7, from_sq] ^ ZOBRIST_TABLE[pieces + 7, to_sq]
+                                      ^ ZOBRIST_TABLE[captured + 7, to_sq] ^ np.uint64(ZOBRIST_BLACK_TO_MOVE))
+        self.players[active] *= -1
+        self.total_moves[active] += 1
+
+        self._update_status(active)
+        return self.done, self.winners
+
+    def _update_status(self, indices):
+        """走子后生成新的合法走法，判定将死、困毙和重复局面
+
+        只有走法生成和局面历史逐局处理，掩码的更新和胜负判定是对整批对局的向量化操作
+        """
+        engine = self._engine
+        legal_indices = []
+        repeated = np.zeros(len(indices), dtype=bool)
+        for j, i in enumerate(indices.tolist()):
+            player = int(self.players[i])
+            engine._set_position(self.squares[i].tolist(), player)
+            legal_indices.append(move_indices(engine._legal_moves(player)))
+
+            key = int(self.zobrist_keys[i])
+            self._history[i].append(key)
+            self._check_history[i].append(engine._is_checked(player))
+            repetitions = self._repetitions[i]
+            repetitions[key] = repetitions.get(key, 0) + 1
+            repeated[j] = repetitions[key] >= REPETITION_LIMIT
+
+        # 用各局的走法编号数组一次写入掩码
+        counts = np.array([len(moves) for moves in legal_indices])
+        self._legal_mask[indices] = False
+        self._legal_mask[np.repeat(indices, counts), np.concatenate(legal_indices)] = True
+
+        # 被将死或困毙，上一个走子的一方获胜
+        mated = indices[counts == 0]
+        self.done[mated] = True
+        self.winners[mated] = -self.players[mated]
+        for i in indices[repeated & (counts > 0)].tolist():
+            self.done[i] = True
+            self.winners[i] = repetition_winner(self._history[i], self._check_history[i], int(self.players[i]))
+            self._legal_mask[i] = False